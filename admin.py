@@ -0,0 +1,47 @@
+# ---------------------------------------------------------------------------- #
+# Admin.
+#
+# Operational stats, for clients sending "Authorization: Bearer <ADMIN_TOKEN>".
+# The endpoints do not exist while ADMIN_TOKEN is unset.
+# ---------------------------------------------------------------------------- #
+import hmac
+
+from flask import Blueprint, abort, current_app, jsonify, request
+
+from cache import cache
+from jobs import jobs
+from models import db
+from pooling import pool_metrics, pool_capacity
+from replicas import replica_router
+
+admin = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+@admin.before_request
+def require_token():
+    token = current_app.config.get('ADMIN_TOKEN')
+    if not token:
+        abort(404)
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.strip().encode(), token.encode()):
+        abort(401)
+
+
+@admin.route('/cache')
+def cache_stats():
+    return jsonify(cache.stats())
+
+
+@admin.route('/pool')
+def pool_stats():
+    return jsonify(pool_metrics.stats(db.get_engine().pool, pool_capacity(current_app.config)))
+
+
+@admin.route('/replicas')
+def replica_stats():
+    return jsonify(replica_router.summary())
+
+
+@admin.route('/jobs')
+def job_stats():
+    return jsonify(jobs.summary())
@@ -0,0 +1,309 @@
+# ---------------------------------------------------------------------------- #
+# JSON API (v1).
+#
+# Every endpoint accepts ?fields=a,b,c to return only those fields.
+# GET /api/v1/venues?ids=1,2,3      batch lookup, one IN query
+# GET /api/v1/venues?after_id=&limit= keyset-paginated listing
+# GET /api/v1/venues/<id>           same data as the venue page
+# (and the same for /artists)
+# GET /api/v1/shows?cursor=&after=&before=
+# GET /api/v1/shows/window?start=&end=&city=&state=&limit=
+# GET /api/v1/venues/<id>/next-shows?limit=&after=   (and for artists)
+# GET /api/v1/venues/near?lat=&lng=&radius_km=&limit=
+# GET /api/v1/artists/<id>/matches?limit=   venues to book the artist at
+# GET /api/v1/venues/<id>/matches?limit=    artists to book at the venue
+#
+# Times are ISO 8601; ones without an offset are taken to be UTC.
+# ---------------------------------------------------------------------------- #
+import hashlib
+import time
+
+import dateutil.parser
+from flask import Blueprint, Response, abort, current_app, jsonify, request
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from cache import cache
+from etags import sources_version, venue_page_sources, artist_page_sources
+from models import Venue, Artist, Show, Match
+from queries import (get_venue_map, get_artist_map, get_shows_page, get_shows_in_window, get_next_shows, as_utc,
+                     get_venues_near, get_nearest_venues, get_venue_matches, get_artist_matches)
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+TIMELINE_FIELDS = {'past_shows', 'past_shows_count', 'upcoming_shows', 'upcoming_shows_count'}
+MAX_BATCH_SIZE = 100
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+SHOW_SOURCES = [Show, Venue, Artist]
+
+
+@api.route('/venues')
+def list_venues():
+    return list_resources(Venue, 'venue', get_venue_map)
+
+
+@api.route('/venues/<int:venue_id>')
+def get_venue(venue_id):
+    return get_resource(Venue, 'venue', venue_id, get_venue_map, venue_page_sources)
+
+
+@api.route('/venues/near')
+def list_venues_near():
+    # Nearest first; without radius_km, the nearest venues up to
+    # GEO_MAX_RADIUS_KM away.
+    fields = requested_fields()
+    max_radius_km = current_app.config['GEO_MAX_RADIUS_KM']
+    try:
+        latitude = float(request.args['lat'])
+        longitude = float(request.args['lng'])
+        radius_km = float(request.args['radius_km']) if request.args.get('radius_km') else None
+        limit = page_size()
+    except (KeyError, ValueError):
+        abort(400)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        abort(400)
+    if radius_km is not None and not 0 < radius_km <= max_radius_km:
+        abort(400)
+
+    def load():
+        if radius_km is not None:
+            return get_venues_near(latitude, longitude, radius_km, limit=limit)
+        return get_nearest_venues(
+            latitude, longitude, limit=limit, max_radius_km=max_radius_km,
+            start_radius_km=current_app.config['GEO_START_RADIUS_KM'],
+        )
+
+    def payload(version):
+        venues = cache.memoize('venues', 'near|%r|%r|%r|%d|%s' % (latitude, longitude, radius_km, limit, version), load)
+        return {'data': [select_fields(venue, fields) for venue in venues]}
+    return conditional_json([Venue], payload)
+
+
+@api.route('/artists')
+def list_artists():
+    return list_resources(Artist, 'artist', get_artist_map)
+
+
+@api.route('/artists/<int:artist_id>')
+def get_artist(artist_id):
+    return get_resource(Artist, 'artist', artist_id, get_artist_map, artist_page_sources)
+
+
+@api.route('/shows')
+def list_shows():
+    fields = requested_fields()
+    try:
+        cursor = request.args.get('cursor')
+        after = parse_datetime(request.args.get('after'))
+        before = parse_datetime(request.args.get('before'))
+        limit = page_size()
+    except ValueError:
+        abort(400)
+
+    def payload(version):
+        try:
+            shows, next_cursor = cache.memoize(
+                'shows',
+                'api|%s|%s|%s|%d|%s' % (cursor, after, before, limit, version),
+                lambda: get_shows_page(cursor=cursor, after=after, before=before, limit=limit)
+            )
+        except ValueError:
+            abort(400)
+        return {
+            'data': [select_fields(show, fields) for show in shows],
+            'next_cursor': next_cursor,
+        }
+    return conditional_json(SHOW_SOURCES, payload)
+
+
+@api.route('/shows/window')
+def list_shows_in_window():
+    fields = requested_fields()
+    try:
+        start = parse_datetime(request.args['start'])
+        end = parse_datetime(request.args['end'])
+        limit = page_size()
+    except (KeyError, ValueError):
+        abort(400)
+    if end <= start:
+        abort(400)
+    city = request.args.get('city')
+    state = request.args.get('state')
+
+    def payload(version):
+        shows = cache.memoize(
+            'shows',
+            'window|%s|%s|%s|%s|%d|%s' % (start.isoformat(), end.isoformat(), city, state, limit, version),
+            lambda: get_shows_in_window(start, end, city=city, state=state, limit=limit)
+        )
+        return {'data': [select_fields(show, fields) for show in shows]}
+    return conditional_json(SHOW_SOURCES, payload)
+
+
+@api.route('/venues/<int:venue_id>/next-shows')
+def list_venue_next_shows(venue_id):
+    return list_next_shows(Venue, 'venue', Show.venue_id, venue_id, venue_page_sources(venue_id))
+
+
+@api.route('/artists/<int:artist_id>/next-shows')
+def list_artist_next_shows(artist_id):
+    return list_next_shows(Artist, 'artist', Show.artist_id, artist_id, artist_page_sources(artist_id))
+
+
+def list_next_shows(model, prefix, owner_column, owner_id, sources):
+    fields = requested_fields()
+    try:
+        after = parse_datetime(request.args.get('after'))
+        limit = page_size()
+    except ValueError:
+        abort(400)
+    namespace = '%s:%d' % (prefix, owner_id)
+
+    def payload(version):
+        def load():
+            model.query.get_or_404(owner_id)
+            return get_next_shows(owner_column, owner_id, limit=limit, after=after)
+        shows = cache.memoize(namespace, 'next|%s|%d|%s' % (after and after.isoformat(), limit, version), load)
+        return {'data': [select_fields(show, fields) for show in shows]}
+    return conditional_json(sources, payload)
+
+
+@api.route('/artists/<int:artist_id>/matches')
+def list_artist_matches(artist_id):
+    return list_matches(Artist, 'artist', artist_id, Match.artist_id, Venue, Match.venue_id, get_venue_matches)
+
+
+@api.route('/venues/<int:venue_id>/matches')
+def list_venue_matches(venue_id):
+    return list_matches(Venue, 'venue', venue_id, Match.venue_id, Artist, Match.artist_id, get_artist_matches)
+
+
+def list_matches(model, prefix, owner_id, owner_column, matched_model, matched_column, get_matches):
+    # Recommendations refreshed by 'flask refresh-matches'; the matched
+    # venues or artists are shown as they are now.
+    fields = requested_fields()
+    try:
+        limit = page_size()
+    except ValueError:
+        abort(400)
+
+    def payload(version):
+        def load():
+            model.query.get_or_404(owner_id)
+            return get_matches(owner_id, limit=limit)
+        return {'data': [
+            select_fields(match, fields)
+            for match in cache.memoize('matches', '%s:%d|%d|%s' % (prefix, owner_id, limit, version), load)
+        ]}
+    return conditional_json([
+        (Match, owner_column == owner_id),
+        (model, model.id == owner_id),
+        (matched_model, matched_model.id.in_(select(matched_column).where(owner_column == owner_id))),
+    ], payload)
+
+
+def get_resource(model, prefix, resource_id, build_map, page_sources):
+    # The show timeline is only loaded when one of its fields is requested.
+    fields = requested_fields()
+    include_shows = fields is None or bool(fields & TIMELINE_FIELDS)
+    namespace = '%s:%d' % (prefix, resource_id)
+    sources = page_sources(resource_id) if include_shows else [(model, model.id == resource_id)]
+
+    def payload(version):
+        data = cache.memoize(
+            namespace,
+            '%s|%s' % ('map' if include_shows else 'profile', version),
+            lambda: build_map(model.query.get_or_404(resource_id), include_shows)
+        )
+        return select_fields(data, fields)
+    return conditional_json(sources, payload)
+
+
+def list_resources(model, prefix, build_map):
+    # List and batch responses carry profile fields only, never timelines.
+    fields = requested_fields()
+    try:
+        ids = [int(value) for value in request.args['ids'].split(',')] if 'ids' in request.args else None
+        after_id = int(request.args.get('after_id', 0))
+        limit = page_size()
+    except ValueError:
+        abort(400)
+
+    query = model.query.options(selectinload(model.genres))
+    if ids is not None:
+        if len(ids) > MAX_BATCH_SIZE:
+            abort(400)
+
+        def payload(version):
+            found = dict((resource.id, resource) for resource in query.filter(model.id.in_(ids)))
+            return {'data': [
+                select_fields(build_map(found[resource_id], False), fields)
+                for resource_id in ids if resource_id in found
+            ]}
+        # The count of the ids also changes when a missing one is created.
+        return conditional_json([(model, model.id.in_(ids))], payload)
+
+    def payload(version):
+        resources = query.filter(model.id > after_id).order_by(model.id).limit(limit).all()
+        return {
+            'data': [select_fields(build_map(resource, False), fields) for resource in resources],
+            'next_after_id': resources[-1].id if len(resources) == limit else None,
+        }
+    return conditional_json([model], payload)
+
+
+def conditional_json(sources, payload):
+    # The ETag is derived from the versions of the tables and (model,
+    # *criteria) rows the response is built from (see etags.sources_version),
+    # read through primary keys and indexes, so a matching If-None-Match is
+    # answered with 304 before the payload is queried or serialized.
+    # payload(version) keys its cached data with the same version, so the
+    # data is never older than the ETag whichever process cached it. The TTL
+    # bucket makes both expire along with the cached data (e.g. shows
+    # turning into past shows).
+    ttl = max(current_app.config.get('CACHE_TTL', 300), 1)
+    version = '%s|%d' % (sources_version(sources), time.time() // ttl)
+    etag = hashlib.sha1(('%s|%s' % (version, request.full_path)).encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(to_json(payload(version)))
+    response.set_etag(etag)
+    return response
+
+
+def requested_fields():
+    if not request.args.get('fields'):
+        return None
+    return set(field.strip() for field in request.args['fields'].split(',') if field.strip())
+
+
+def select_fields(data, fields):
+    if fields is None:
+        return data
+    return dict((key, value) for key, value in data.items() if key in fields)
+
+
+def page_size():
+    return max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+
+
+def parse_datetime(value):
+    return as_utc(dateutil.parser.isoparse(value)) if value else None
+
+
+def to_json(value):
+    if isinstance(value, dict):
+        return dict((key, to_json(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [to_json(item) for item in value]
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def api_error(error):
+    return jsonify({'error': error.name}), error.code
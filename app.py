@@ -1,20 +1,39 @@
 # ---------------------------------------------------------------------------- #
 # Imports
 # ---------------------------------------------------------------------------- #
+import functools
 import sys
+from datetime import timedelta
 
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort, stream_with_context
 from flask_migrate import Migrate
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
+from sqlalchemy.exc import IntegrityError
 from config import SQLALCHEMY_DATABASE_URI
 from forms import *
-from models import Venue, Artist, Show, db
+from models import Venue, Artist, Show, Genre, Match, venue_genres, db, DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION
+import search
+from admin import admin
+from assets import assets, build_assets_command
+from api import api
+from cache import cache
+from compression import compressor
+from etags import page_etags
+from geocoder import geocode_command
+from matchmaking import refresh_matches_command
+from fragments import FragmentCacheExtension
+from jobs import jobs, jobs_worker_command
+import tasks
+from profiling import profiler, configure_logging
+from replicas import replica_router
+import export
+from ingest import import_command
+from show_counters import refresh_show_counters, roll_shows_command
+from queries import get_venue_areas, get_artists, get_venue_map, get_artist_map, get_shows_page, find_show_conflict, as_utc
 
 # ---------------------------------------------------------------------------- #
 # App Config.
@@ -25,13 +44,52 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 
+# Response compression; registered first so that it runs after every other
+# after_request hook.
+compressor.init_app(app)
+
 # Database setup
 db.init_app(app)
+replica_router.init_app(app)
 migrate = Migrate(app, db)
 
+# Static assets
+assets.init_app(app)
+
+# Caching
+cache.init_app(app)
+app.register_blueprint(admin)
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache_enabled = app.config['FRAGMENT_CACHE']
+app.jinja_env.globals['page_version'] = page_etags.version
+
+# Background jobs
+jobs.init_app(app)
+
+# Per-request query profiling
+profiler.init_app(app)
+
+# Conditional GET for the listing and detail pages
+page_etags.init_app(app)
+
+# JSON API
+app.register_blueprint(api)
+
+# Command line
+app.cli.add_command(import_command)
+app.cli.add_command(export.export_command)
+app.cli.add_command(roll_shows_command)
+app.cli.add_command(jobs_worker_command)
+app.cli.add_command(build_assets_command)
+app.cli.add_command(geocode_command)
+app.cli.add_command(refresh_matches_command)
+
 # ---------------------------------------------------------------------------- #
 # Filters.
 # ---------------------------------------------------------------------------- #
+# Listing pages format the same few values over and over; parsing and
+# formatting them is the most expensive part of rendering a show.
+@functools.lru_cache(maxsize=4096)
 def format_datetime(value, format='medium'):
     # Added a small fix from StackOverflow to parse dates
     # https://stackoverflow.com/questions/63269150/typeerror-parser-must-be-a-string-or-character-stream-not-datetime
@@ -50,6 +108,28 @@ def format_datetime(value, format='medium'):
 app.jinja_env.filters['datetime'] = format_datetime
 
 
+# ---------------------------------------------------------------------------- #
+# Cache invalidation.
+# ---------------------------------------------------------------------------- #
+# Cached view models are grouped in namespaces: 'venues', 'artists' and
+# 'shows' for the listings, 'venue:<id>' and 'artist:<id>' for detail pages.
+# Each write invalidates exactly the namespaces whose pages display it. The
+# keys also carry the version of the rows behind the page (see etags.py),
+# so a process that missed an invalidation still misses the cache.
+def venue_cache_namespaces(venue_id):
+    artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+    return ['venues', 'shows', 'venue:%s' % venue_id] + ['artist:%d' % row.artist_id for row in artist_ids]
+
+
+def artist_cache_namespaces(artist_id):
+    venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()
+    return ['artists', 'shows', 'artist:%s' % artist_id] + ['venue:%d' % row.venue_id for row in venue_ids]
+
+
+def show_cache_namespaces(venue_id, artist_id):
+    return ['venues', 'shows', 'venue:%s' % venue_id, 'artist:%s' % artist_id]
+
+
 # ---------------------------------------------------------------------------- #
 # Controllers.
 # ---------------------------------------------------------------------------- #
@@ -62,38 +142,19 @@ def index():
 #  ----------------------------------------------------------------
 @app.route('/venues')
 def venues():
-    venues_grouped_by_cities = db.session.query(Venue.city, Venue.state).group_by('city', 'state')
-    data = []
-
-    for group in venues_grouped_by_cities:
-        venues_data = []
-        venues_in_city = db.session.query(Venue)\
-            .filter(Venue.city == group.city)\
-            .filter(Venue.state == group.state)
-        for venue in venues_in_city:
-            venue_data = extract_displayed_fields_from_venue_or_artist(venue)
-            venues_data.append(venue_data)
-        if len(venues_data) > 0:
-            city_data = {
-                'city': group.city,
-                'state': group.state,
-                'venues': venues_data
-            }
-            data.append(city_data)
+    data = cache.memoize('venues', 'all|' + page_etags.version(), get_venue_areas)
+    return render_template('pages/venues.html', areas=data)
+
+
+@app.route('/venues/genres/<genre>')
+def venues_by_genre(genre):
+    data = cache.memoize('venues', 'genre:%s|%s' % (genre, page_etags.version()), lambda: get_venue_areas(genre))
     return render_template('pages/venues.html', areas=data)
 
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-    matches = Venue.query.filter(Venue.name.ilike('%' + request.form.get("search_term", "") + '%')).all()
-    venues_data = []
-    for venue in matches:
-        venue_data = extract_displayed_fields_from_venue_or_artist(venue)
-        venues_data.append(venue_data)
-    response = {
-        'count': len(venues_data),
-        'data': venues_data
-    }
+    response = search.search_venues(request.form.get('search_term', ''), app.config['SEARCH_RESULTS_LIMIT'])
     return render_template(
         'pages/search_venues.html',
         results=response,
@@ -103,38 +164,13 @@ def search_venues():
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-    venue = Venue.query.get(venue_id)
-    data = get_venue_map(venue)
+    data = cache.memoize(
+        'venue:%d' % venue_id, 'map|' + page_etags.version(), lambda: get_venue_map(Venue.query.get_or_404(venue_id))
+    )
 
     return render_template('pages/show_venue.html', venue=data)
 
 
-def get_venue_map(venue, include_shows=True):
-    upcoming_shows = list(filter(lambda show: datetime.now() < show.start_time.replace(tzinfo=None), venue.shows))
-    past_shows = list(filter(lambda show: datetime.now() >= show.start_time.replace(tzinfo=None), venue.shows))
-    upcoming_shows_data = extract_show_data_for_venue(upcoming_shows)
-    past_shows_data = extract_show_data_for_venue(past_shows)
-    venue_map = {
-        'id': venue.id,
-        'name': venue.name,
-        'genres': venue.genres,
-        'address': venue.address,
-        'city': venue.city,
-        'state': venue.state,
-        'phone': venue.phone,
-        'website': venue.website_link,
-        'facebook_link': venue.facebook_link,
-        'seeking_talent': venue.seeking_talent,
-        'seeking_description': venue.seeking_description,
-        'image_link': venue.image_link,
-    }
-    if include_shows:
-        venue_map['past_shows'] = past_shows_data
-        venue_map['past_shows_count'] = len(past_shows_data)
-        venue_map['upcoming_shows'] = upcoming_shows_data
-        venue_map['upcoming_shows_count'] = len(upcoming_shows_data)
-    return venue_map
-
 #  Create Venue
 #  ----------------------------------------------------------------
 @app.route('/venues/create', methods=['GET'])
@@ -159,10 +195,12 @@ def create_venue_submission():
             website_link=request.form['website_link'],
             seeking_talent=request.form['seeking_talent'] == 'y',
             seeking_description=request.form['seeking_description'],
-            genres=','.join(request.form.getlist('genres'))
+            genres=Genre.from_names(request.form.getlist('genres'))
         )
         db.session.add(data)
         db.session.commit()
+        cache.invalidate('venues')
+        tasks.warm_caches_later(['venues'])
     except:
         error = True
         db.session.rollback()
@@ -180,62 +218,51 @@ def create_venue_submission():
 
 @app.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
+    error = False
     try:
+        namespaces = venue_cache_namespaces(venue_id)
+        # The venue's shows go with it, so the counters of the artists who
+        # were playing there change too.
+        artist_ids = [
+            row.artist_id for row in db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+        ]
+        Show.query.filter_by(venue_id=venue_id).delete()
+        Match.query.filter_by(venue_id=venue_id).delete()
+        db.session.execute(venue_genres.delete().where(venue_genres.c.venue_id == venue_id))
         Venue.query.filter_by(id=venue_id).delete()
+        refresh_show_counters(artist_ids=artist_ids)
         db.session.commit()
+        cache.invalidate(*namespaces)
+        tasks.warm_caches_later(namespaces)
     except:
+        error = True
         db.session.rollback()
+        print(sys.exc_info())
     finally:
         db.session.close()
 
+    if error:
+        return jsonify({'success': False}), 500
     return jsonify({'success': True})
 
 
-def extract_displayed_fields_from_venue_or_artist(venue_or_artist):
-    upcoming_shows = list(filter(lambda show: datetime.now() < show.start_time.replace(tzinfo=None), venue_or_artist.shows))
-    return {
-        'id': venue_or_artist.id,
-        'name': venue_or_artist.name,
-        'num_upcoming_shows': len(upcoming_shows),
-    }
-
-
-def extract_show_data_for_venue(shows_from_db):
-    shows_data = []
-    for show in shows_from_db:
-        shows_data.append({
-            'artist_id': show.artist.id,
-            'artist_name': show.artist.name,
-            'artist_image_link': show.artist.image_link,
-            'start_time': show.start_time
-        })
-    return shows_data
-
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-    artists_from_db = Artist.query.all()
-    data = []
-    for artist in artists_from_db:
-        data.append({
-            'id': artist.id,
-            'name': artist.name,
-        })
+    data = cache.memoize('artists', 'all|' + page_etags.version(), get_artists)
+    return render_template('pages/artists.html', artists=data)
+
+
+@app.route('/artists/genres/<genre>')
+def artists_by_genre(genre):
+    data = cache.memoize('artists', 'genre:%s|%s' % (genre, page_etags.version()), lambda: get_artists(genre))
     return render_template('pages/artists.html', artists=data)
 
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-    matches = Artist.query.filter(Artist.name.ilike('%' + request.form.get("search_term", "") + '%')).all()
-    artists_data = []
-    for artist in matches:
-        artist_data = extract_displayed_fields_from_venue_or_artist(artist)
-        artists_data.append(artist_data)
-    response = {
-        'count': len(artists_data),
-        'data': artists_data
-    }
+    response = search.search_artists(request.form.get('search_term', ''), app.config['SEARCH_RESULTS_LIMIT'])
     return render_template(
         'pages/search_artists.html',
         results=response,
@@ -245,50 +272,13 @@ def search_artists():
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-    artist = Artist.query.get(artist_id)
-    data = get_artist_map(artist)
+    data = cache.memoize(
+        'artist:%d' % artist_id, 'map|' + page_etags.version(), lambda: get_artist_map(Artist.query.get_or_404(artist_id))
+    )
 
     return render_template('pages/show_artist.html', artist=data)
 
 
-def get_artist_map(artist, include_shows=True):
-    upcoming_shows = list(filter(lambda show: datetime.now() < show.start_time.replace(tzinfo=None), artist.shows))
-    upcoming_shows_data = extract_show_data_for_artist(upcoming_shows)
-    past_shows = list(filter(lambda show: datetime.now() >= show.start_time.replace(tzinfo=None), artist.shows))
-    past_shows_data = extract_show_data_for_artist(past_shows)
-    artist_map = {
-        'id': artist.id,
-        'name': artist.name,
-        'genres': artist.genres,
-        'city': artist.city,
-        'state': artist.state,
-        'phone': artist.phone,
-        'website': artist.website,
-        'facebook_link': artist.facebook_link,
-        'seeking_venue': artist.seeking_venue,
-        'seeking_description': artist.seeking_description,
-        'image_link': artist.image_link,
-    }
-    if include_shows:
-        artist_map['past_shows'] = past_shows_data
-        artist_map['past_shows_count'] = len(past_shows_data)
-        artist_map['upcoming_shows'] = upcoming_shows_data
-        artist_map['upcoming_shows_count'] = len(upcoming_shows_data)
-    return artist_map
-
-
-def extract_show_data_for_artist(shows_from_db):
-    shows_data = []
-    for show in shows_from_db:
-        shows_data.append({
-            'venue_id': show.venue.id,
-            'venue_name': show.venue.name,
-            'venue_image_link': show.artist.image_link,
-            'start_time': show.start_time
-        })
-    return shows_data
-
-
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
@@ -326,8 +316,11 @@ def edit_artist_submission(artist_id):
         artist.website = request.form['website_link']
         artist.seeking_venue = request.form['seeking_venue'] == 'y'
         artist.seeking_description = request.form['seeking_description']
-        artist.genres = ','.join(request.form.getlist('genres'))
+        artist.genres = Genre.from_names(request.form.getlist('genres'))
+        namespaces = artist_cache_namespaces(artist_id)
         db.session.commit()
+        cache.invalidate(*namespaces)
+        tasks.warm_caches_later(namespaces)
     except:
         error = True
         db.session.rollback()
@@ -380,8 +373,11 @@ def edit_venue_submission(venue_id):
         venue.website_link = request.form['website_link']
         venue.seeking_talent = request.form['seeking_talent'] == 'y'
         venue.seeking_description = request.form['seeking_description']
-        venue.genres = ','.join(request.form.getlist('genres'))
+        venue.genres = Genre.from_names(request.form.getlist('genres'))
+        namespaces = venue_cache_namespaces(venue_id)
         db.session.commit()
+        cache.invalidate(*namespaces)
+        tasks.warm_caches_later(namespaces)
     except:
         error = True
         db.session.rollback()
@@ -420,10 +416,12 @@ def create_artist_submission():
             website=request.form['website_link'],
             seeking_venue=request.form['seeking_venue'] == 'y',
             seeking_description=request.form['seeking_description'],
-            genres=','.join(request.form.getlist('genres'))
+            genres=Genre.from_names(request.form.getlist('genres'))
         )
         db.session.add(data)
         db.session.commit()
+        cache.invalidate('artists')
+        tasks.warm_caches_later(['artists'])
     except:
         error = True
         db.session.rollback()
@@ -443,18 +441,36 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 @app.route('/shows')
 def shows():
-    shows_from_db = Show.query.all()
-    data = []
-    for show in shows_from_db:
-        data.append({
-            'venue_id': show.venue_id,
-            'venue_name': show.venue.name,
-            'artist_id': show.artist_id,
-            'artist_name': show.artist.name,
-            'artist_image_link': show.artist.image_link,
-            'start_time': show.start_time,
-        })
-    return render_template('pages/shows.html', shows=data)
+    try:
+        cursor = request.args.get('cursor')
+        after = parse_datetime_arg('after')
+        before = parse_datetime_arg('before')
+        key = '%s|%s|%s|%s' % (cursor, after, before, page_etags.version())
+        data, next_cursor = cache.memoize('shows', key, lambda: get_shows_page(
+            cursor=cursor,
+            after=after,
+            before=before,
+            limit=app.config['SHOWS_PAGE_SIZE']
+        ))
+    except ValueError:
+        abort(400)
+
+    next_url = None
+    if next_cursor is not None:
+        next_url = url_for(
+            'shows',
+            cursor=next_cursor,
+            after=request.args.get('after'),
+            before=request.args.get('before')
+        )
+    return render_template('pages/shows.html', shows=data, next_url=next_url)
+
+
+def parse_datetime_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return as_utc(dateutil.parser.isoparse(value))
 
 
 @app.route('/shows/create')
@@ -467,30 +483,72 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     error = False
+    conflict = None
     data = None
     try:
-        data = Show(start_time=request.form['start_time'])
+        start_time = as_utc(dateutil.parser.parse(request.form['start_time']))
+        duration = DEFAULT_SHOW_DURATION
+        if request.form.get('duration'):
+            duration = timedelta(minutes=int(request.form['duration']))
+        if not timedelta(0) < duration <= MAX_SHOW_DURATION:
+            raise ValueError('duration out of range: %s' % duration)
+        end_time = start_time + duration
         venue = Venue.query.get(request.form['venue_id'])
         artist = Artist.query.get(request.form['artist_id'])
-        data.venue = venue
-        data.artist = artist
-        db.session.add(data)
-        db.session.commit()
+        for label, column, owner in (('venue', Show.venue_id, venue), ('artist', Show.artist_id, artist)):
+            overlapping = find_show_conflict(column, owner.id, start_time, end_time)
+            if overlapping is not None:
+                conflict = (label, overlapping)
+                break
+        if conflict is None:
+            data = Show(start_time=start_time, end_time=end_time)
+            data.venue = venue
+            data.artist = artist
+            db.session.add(data)
+            db.session.flush()
+            refresh_show_counters([data.venue_id], [data.artist_id])
+            db.session.commit()
+            namespaces = show_cache_namespaces(request.form['venue_id'], request.form['artist_id'])
+            cache.invalidate(*namespaces)
+            tasks.warm_caches_later(namespaces)
+    except IntegrityError:
+        # On Postgres the exclusion constraints catch a show booked by a
+        # concurrent request after the check above.
+        error = True
+        db.session.rollback()
+        flash('Show could not be listed: the venue or the artist has just been booked for that time.')
     except:
         error = True
         db.session.rollback()
         print(sys.exc_info())
+        flash('An error occurred. Show could not be listed.')
     finally:
         db.session.close()
 
-    if error:
-        flash('An error occurred. Show could not be listed.')
-    else:
+    if conflict is not None:
+        label, overlapping = conflict
+        flash('Show could not be listed: the %s is already booked from %s to %s.' % (
+            label, format_datetime(overlapping.start_time), format_datetime(overlapping.end_time)
+        ))
+    elif not error:
         flash('Show was successfully listed!')
 
     return render_template('pages/home.html')
 
 
+#  Export
+#  ----------------------------------------------------------------
+@app.route('/export/<entity>.<file_format>')
+def export_catalog(entity, file_format):
+    if entity not in export.COLUMNS or file_format not in export.FORMATS:
+        abort(404)
+    return Response(
+        stream_with_context(export.generate_export(entity, file_format)),
+        mimetype='application/gzip',
+        headers={'Content-Disposition': 'attachment; filename=' + export.export_filename(entity, file_format)}
+    )
+
+
 # ---------------------------------------------------------------------------- #
 # Error Handling.
 # ---------------------------------------------------------------------------- #
@@ -504,15 +562,7 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+configure_logging(app)
 
 # ---------------------------------------------------------------------------- #
 # Launch.
@@ -0,0 +1,137 @@
+# ---------------------------------------------------------------------------- #
+# ASGI entry point.
+#
+# Usage: uvicorn asgi:application --workers 4
+#
+# The read-heavy pages (ASYNC_ENDPOINTS) are served on the event loop: the
+# Flask view runs inside AsyncSession.run_sync, with db.session bound to
+# the async session's sync facade, so its queries go through asyncpg or
+# aiosqlite and other requests proceed while one waits on the database.
+# Templates, the cache, flash messages and the session cookie behave as
+# under WSGI. Every other route goes to the WSGI app on a thread pool.
+# ---------------------------------------------------------------------------- #
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+
+from app import app as flask_app
+from models import db
+from profiling import profiler
+
+ASYNC_ENDPOINTS = {
+    'venues', 'venues_by_genre', 'search_venues', 'show_venue',
+    'artists', 'artists_by_genre', 'search_artists', 'show_artist',
+    'shows',
+}
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def async_engine_options(config, backend):
+    if backend == 'sqlite':
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(config['DB_STATEMENT_TIMEOUT_MS'])}}
+    return options
+
+
+class Application:
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app)
+        self.url_adapter = flask_app.url_map.bind('localhost')
+        self.engine = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and self.endpoint(scope) in ASYNC_ENDPOINTS:
+            return await self.handle(scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def start(self):
+        if self.engine is not None:
+            return
+        config = self.flask_app.config
+        url = async_database_uri(config['SQLALCHEMY_DATABASE_URI'])
+        self.engine = create_async_engine(url, **async_engine_options(config, url.get_backend_name()))
+        profiler.instrument(self.engine.sync_engine)
+
+    def endpoint(self, scope):
+        try:
+            return self.url_adapter.match(scope['path'], scope['method'])[0]
+        except HTTPException:
+            return None
+
+    async def handle(self, scope, receive, send):
+        self.start()
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        environ = EnvironBuilder(
+            path=scope['path'],
+            base_url='%s://%s' % (scope.get('scheme', 'http'), dict(scope['headers']).get(b'host', b'localhost').decode()),
+            query_string=scope['query_string'].decode('latin-1'),
+            method=scope['method'],
+            headers=[(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']],
+            data=body,
+        ).get_environ()
+        async with AsyncSession(self.engine) as session:
+            status, headers, data = await session.run_sync(self.dispatch, environ)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+    def dispatch(self, sync_session, environ):
+        # Runs inside the greenlet of run_sync, which is also the scope of
+        # Flask-SQLAlchemy's scoped session.
+        db.session.registry.set(sync_session)
+        try:
+            with self.flask_app.request_context(environ):
+                try:
+                    response = self.flask_app.full_dispatch_request()
+                except Exception as e:
+                    response = self.flask_app.make_response(self.flask_app.handle_exception(e))
+                return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+        finally:
+            db.session.registry.clear()
+
+
+application = Application(flask_app)
@@ -0,0 +1,206 @@
+# ---------------------------------------------------------------------------- #
+# Static assets.
+#
+# Usage: flask build-assets
+#
+# Concatenates and minifies each bundle in BUNDLES, copies FILES and the
+# files the stylesheets refer to, and writes them to static/dist under
+# content-hashed names with .gz and .br variants, plus a manifest. With
+# ASSETS_BUNDLED on and a manifest built, templates link to those files:
+#
+#   {% for url in asset_urls('main.css') %}<link rel="stylesheet" href="{{ url }}">{% endfor %}
+#   <img src="{{ asset_url('img/front-splash.jpg') }}">
+#
+# and they are served with a one-year immutable Cache-Control, in the best
+# encoding the client accepts. Otherwise the source files are linked one
+# by one through the regular static route.
+# ---------------------------------------------------------------------------- #
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+import brotli
+import click
+import rcssmin
+import rjsmin
+from flask import abort, current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+# Bundle name -> source files, relative to the static folder, in order.
+BUNDLES = {
+    'main.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    'form.css': [
+        'css/bootstrap.min.css',
+        'css/bootstrap-theme.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    'head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js',
+    ],
+    'main.js': [
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js',
+        'js/script.js',
+    ],
+}
+# Files linked on their own.
+FILES = [
+    'js/libs/jquery-1.11.1.min.js',
+    'js/libs/respond-1.4.2.min.js',
+    'img/front-splash.jpg',
+]
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.map', '.txt', '.eot', '.ttf', '.otf'}
+MAX_AGE = 365 * 24 * 3600
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+class Assets:
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.encodings = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.dist = app.config.get('ASSETS_DIST') or os.path.join(app.static_folder, 'dist')
+        self.manifest = {}
+        self.encodings = {}
+        if app.config.get('ASSETS_BUNDLED'):
+            try:
+                with open(os.path.join(self.dist, 'manifest.json')) as source:
+                    manifest = json.load(source)
+                self.manifest, self.encodings = manifest['files'], manifest['encodings']
+            except FileNotFoundError:
+                app.logger.warning('ASSETS_BUNDLED is on but no assets were built; run flask build-assets')
+        app.add_url_rule(app.static_url_path + '/dist/<path:filename>', 'asset', self.send_asset)
+        app.jinja_env.globals.update(asset_url=self.url, asset_urls=self.urls)
+        app.extensions['assets'] = self
+
+    def url(self, path):
+        if path in self.manifest:
+            return url_for('asset', filename=self.manifest[path])
+        return url_for('static', filename=path)
+
+    def urls(self, bundle):
+        if bundle in self.manifest:
+            return [self.url(bundle)]
+        return [url_for('static', filename=path) for path in BUNDLES[bundle]]
+
+    def send_asset(self, filename):
+        # Only built files are served, so everything here is fingerprinted
+        # and can be cached forever.
+        if filename not in self.encodings:
+            abort(404)
+        served, encoding = filename, None
+        for candidate in ('br', 'gzip'):
+            if candidate in self.encodings[filename] and request.accept_encodings[candidate]:
+                served = '%s.%s' % (filename, 'gz' if candidate == 'gzip' else candidate)
+                encoding = candidate
+                break
+        response = send_from_directory(
+            self.dist, served, mimetype=mimetypes.guess_type(filename)[0], max_age=MAX_AGE
+        )
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def build_assets(static_folder, dist):
+    # Rebuilds dist from scratch; returns the manifest it wrote.
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+    files = {}
+    encodings = {}
+
+    def write(path, content):
+        root, extension = os.path.splitext(path)
+        name = '%s.%s%s' % (root, hashlib.sha256(content).hexdigest()[:12], extension)
+        os.makedirs(os.path.dirname(os.path.join(dist, name)), exist_ok=True)
+        with open(os.path.join(dist, name), 'wb') as destination:
+            destination.write(content)
+        encodings[name] = []
+        if extension in COMPRESSIBLE:
+            for encoding, suffix, compressed in (
+                ('gzip', 'gz', gzip.compress(content, 9, mtime=0)),
+                ('br', 'br', brotli.compress(content, quality=11)),
+            ):
+                if len(compressed) < len(content):
+                    with open(os.path.join(dist, '%s.%s' % (name, suffix)), 'wb') as destination:
+                        destination.write(compressed)
+                    encodings[name].append(encoding)
+        files[path] = name
+        return name
+
+    def copy(path):
+        if path not in files:
+            with open(os.path.join(static_folder, path), 'rb') as source:
+                write(path, source.read())
+        return files[path]
+
+    def rewrite_urls(source_path, css):
+        # Relative url()s are resolved against the source stylesheet; files
+        # that exist are fingerprinted too, others keep pointing at the
+        # static folder.
+        def replace(match):
+            url = match.group(2)
+            if re.match(r'^([a-z]+:|/|#)', url):
+                return match.group(0)
+            path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+            path = os.path.normpath(os.path.join(os.path.dirname(source_path), path)).replace(os.sep, '/')
+            if os.path.isfile(os.path.join(static_folder, path)):
+                target = copy(path)
+            else:
+                target = os.path.relpath(os.path.join(static_folder, path), dist).replace(os.sep, '/')
+            return 'url("%s%s")' % (target, suffix)
+        return CSS_URL.sub(replace, css)
+
+    for bundle, sources in BUNDLES.items():
+        parts = []
+        for path in sources:
+            with open(os.path.join(static_folder, path), encoding='utf-8') as source:
+                content = source.read()
+            if bundle.endswith('.css'):
+                parts.append(rcssmin.cssmin(rewrite_urls(path, content), keep_bang_comments=True))
+            else:
+                parts.append(rjsmin.jsmin(content, keep_bang_comments=True))
+        write(bundle, ('\n' if bundle.endswith('.css') else ';\n').join(parts).encode('utf-8'))
+    for path in FILES:
+        copy(path)
+
+    manifest = {'files': files, 'encodings': encodings}
+    with open(os.path.join(dist, 'manifest.json'), 'w') as destination:
+        json.dump(manifest, destination, indent=2, sort_keys=True)
+    return manifest
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Bundle, minify, fingerprint and precompress the static assets."""
+    dist = current_app.extensions['assets'].dist
+    manifest = build_assets(current_app.static_folder, dist)
+    for path, name in sorted(manifest['files'].items()):
+        sizes = ['%s %d' % (encoding, os.path.getsize(os.path.join(dist, '%s.%s' % (name, suffix))))
+                 for encoding, suffix in (('gzip', 'gz'), ('br', 'br')) if encoding in manifest['encodings'][name]]
+        click.echo('%-32s %-48s %8d bytes  %s' % (path, name, os.path.getsize(os.path.join(dist, name)), ', '.join(sizes)))
+
+
+assets = Assets()
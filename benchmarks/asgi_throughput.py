@@ -0,0 +1,131 @@
+# ---------------------------------------------------------------------------- #
+# Concurrent-request throughput of the WSGI and ASGI serving modes.
+#
+# Usage: python -m benchmarks.asgi_throughput [--database URI] [--concurrency N]
+#                                             [--requests N] [--cache BACKEND]
+#
+# Seeds the database (a temporary SQLite file by default; any existing
+# tables are dropped), then starts each server in turn on a local port:
+#   wsgi  the threaded Flask server, as 'python app.py' runs it
+#   asgi  uvicorn serving asgi:application
+# and sends the same mix of read requests with N in flight at a time.
+# ---------------------------------------------------------------------------- #
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from app import app
+from benchmarks.seed import seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = [
+    '/venues', '/artists', '/shows', '/venues/genres/Jazz',
+    '/venues/1', '/venues/2', '/venues/3', '/artists/1', '/artists/2', '/artists/3',
+]
+SERVERS = {
+    'wsgi': [sys.executable, '-c', 'from app import app; app.run(port={port}, debug=False, threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', '{port}', '--log-level', 'warning'],
+}
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(mode, port, environment):
+    command = [part.format(port=port) for part in SERVERS[mode]]
+    process = subprocess.Popen(command, cwd=ROOT, env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get('http://127.0.0.1:%d/' % port, timeout=1)
+            return process
+        except httpx.TransportError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('%s server did not start' % mode)
+
+
+async def load(base_url, concurrency, total):
+    timings = []
+    errors = 0
+    paths = iter(range(total))
+
+    async def worker(client):
+        nonlocal errors
+        for i in paths:
+            started_at = time.perf_counter()
+            try:
+                response = await client.get(PATHS[i % len(PATHS)])
+                errors += response.status_code != 200
+            except httpx.HTTPError:
+                errors += 1
+            timings.append((time.perf_counter() - started_at) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started_at = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started_at
+    timings.sort()
+    return {
+        'requests_per_second': total / elapsed,
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[int(len(timings) * 0.95) - 1],
+        'errors': errors,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Compare WSGI and ASGI throughput under concurrent load.')
+    parser.add_argument('--database', help='Database URI; defaults to a temporary SQLite file.')
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--cache', default='null', choices=['null', 'lru'],
+                        help='Cache backend of the servers; the default makes every request query.')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    database = args.database or 'sqlite:///' + os.path.join(workdir, 'benchmark.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    with app.app_context():
+        seed(args.venues, args.artists, args.shows)
+
+    environment = dict(
+        os.environ,
+        DATABASE_URL=database,
+        CACHE_BACKEND=args.cache,
+        LOG_FILE=os.path.join(workdir, 'server.log'),
+    )
+    print('%-6s %10s %10s %10s %8s' % ('mode', 'req/s', 'p50 ms', 'p95 ms', 'errors'))
+    for mode in SERVERS:
+        port = free_port()
+        process = start_server(mode, port, environment)
+        try:
+            result = asyncio.run(load('http://127.0.0.1:%d' % port, args.concurrency, args.requests))
+        finally:
+            process.terminate()
+            process.wait()
+        print('%-6s %10.1f %10.1f %10.1f %8d' % (
+            mode, result['requests_per_second'], result['p50_ms'], result['p95_ms'], result['errors']
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,92 @@
+# ---------------------------------------------------------------------------- #
+# Checks that the hot queries are planned as index scans.
+#
+# Usage: python -m benchmarks.explain_indexes [database-uri]
+#
+# Seeds the database (SQLite in memory by default), captures the statements
+# issued by each hot query, runs EXPLAIN on them and fails when the plan
+# does not use the expected index.
+# ---------------------------------------------------------------------------- #
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import app
+from benchmarks.seed import seed, CITIES, CITY_LOCATIONS
+from etags import PAGE_SOURCES, sources_version, venue_page_sources, artist_page_sources
+from models import Venue, Show, db
+from queries import (get_venue_show_timeline, get_artist_show_timeline, get_shows_page, find_show_conflict,
+                     get_shows_in_window, get_next_shows, get_venues_near, has_location_index,
+                     get_venue_matches, get_artist_matches)
+
+VENUES = 500
+ARTISTS = 500
+SHOWS = 50000
+
+HOT_QUERIES = [
+    ('venue show timeline', lambda: get_venue_show_timeline(1, 50), 'ix_Show_venue_id_start_time'),
+    ('artist show timeline', lambda: get_artist_show_timeline(1, 50), 'ix_Show_artist_id_start_time'),
+    ('shows feed', lambda: get_shows_page(limit=30), 'ix_Show_start_time_id'),
+    ('venues in an area', lambda: db.session.query(Venue.id).filter(
+        Venue.city == CITIES[0][0], Venue.state == CITIES[0][1]).all(), 'ix_Venue_city_state'),
+    ('show conflict check', lambda: find_show_conflict(
+        Show.venue_id, 1, datetime.now(), datetime.now() + timedelta(hours=2)), 'ix_Show_venue_id_start_time'),
+    ('shows in a week', lambda: get_shows_in_window(
+        datetime.now(), datetime.now() + timedelta(days=7)), 'ix_Show_start_time_id'),
+    ('next shows of an artist', lambda: get_next_shows(Show.artist_id, 1), 'ix_Show_artist_id_start_time'),
+    ('venues near a point', lambda: get_venues_near(*CITY_LOCATIONS[CITIES[0][0]], 5),
+     lambda: 'ix_Venue_location' if has_location_index() else 'ix_Venue_geohash'),
+    ('venue matches of an artist', lambda: get_venue_matches(1), 'ix_Match_artist_id_artist_rank'),
+    ('artist matches of a venue', lambda: get_artist_matches(1), 'ix_Match_venue_id_venue_rank'),
+    ('version of a venue page', lambda: sources_version(venue_page_sources(1)), 'ix_Show_venue_id_updated_at'),
+    ('version of an artist page', lambda: sources_version(artist_page_sources(1)), 'ix_Show_artist_id_updated_at'),
+    # A primary key lookup per table (sqlite_autoindex_TableVersion_1, TableVersion_pkey).
+    ('version of the shows page', lambda: sources_version(PAGE_SOURCES['shows']()), 'TableVersion'),
+]
+
+
+def capture_statements(run):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engine = db.get_engine()
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        run()
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    return statements
+
+
+def explain(statement, parameters):
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+def main(database_uri):
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    failures = 0
+    with app.app_context():
+        seed(VENUES, ARTISTS, SHOWS)
+        for name, run, index in HOT_QUERIES:
+            if callable(index):
+                # Depends on the database's extensions.
+                index = index()
+            for statement, parameters in capture_statements(run):
+                plan = explain(statement, parameters)
+                ok = index in plan
+                failures += not ok
+                print('%s  %s (expects %s)' % ('ok  ' if ok else 'FAIL', name, index))
+                if not ok:
+                    print('      ' + statement.replace('\n', ' '))
+                    print('      ' + plan.replace('\n', '\n      '))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://'))
@@ -0,0 +1,175 @@
+# ---------------------------------------------------------------------------- #
+# Synthetic data generator.
+#
+# Usage: python -m benchmarks.seed DATABASE_URI [--venues N] [--artists N] [--shows N]
+# ---------------------------------------------------------------------------- #
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import geo
+from cache import cache
+from forms import Genre as GenreChoice
+from models import Venue, Artist, Show, Genre, venue_genres, artist_genres, db, DEFAULT_SHOW_DURATION
+from matchmaking import refresh_matches
+from show_counters import rebuild_show_counters
+
+CHUNK_SIZE = 5000
+CITIES = [
+    ('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'), ('Brooklyn', 'NY'),
+    ('Austin', 'TX'), ('Houston', 'TX'), ('Chicago', 'IL'), ('Seattle', 'WA'), ('Portland', 'OR'),
+    ('Denver', 'CO'), ('Nashville', 'TN'), ('New Orleans', 'LA'), ('Atlanta', 'GA'), ('Boston', 'MA'),
+]
+CITY_LOCATIONS = {
+    'San Francisco': (37.7749, -122.4194), 'Los Angeles': (34.0522, -118.2437), 'New York': (40.7128, -74.0060),
+    'Brooklyn': (40.6782, -73.9442), 'Austin': (30.2672, -97.7431), 'Houston': (29.7604, -95.3698),
+    'Chicago': (41.8781, -87.6298), 'Seattle': (47.6062, -122.3321), 'Portland': (45.5152, -122.6784),
+    'Denver': (39.7392, -104.9903), 'Nashville': (36.1627, -86.7816), 'New Orleans': (29.9511, -90.0715),
+    'Atlanta': (33.7490, -84.3880), 'Boston': (42.3601, -71.0589),
+}
+WORDS = [
+    'Blue', 'Red', 'Velvet', 'Electric', 'Golden', 'Silent', 'Wild', 'Midnight', 'Neon', 'Paper',
+    'Iron', 'Crystal', 'Lonely', 'Rolling', 'Hollow', 'Dusty', 'Northern', 'Little', 'Howling', 'Static',
+]
+VENUE_KINDS = ['Hall', 'Lounge', 'Club', 'Theatre', 'Room', 'Bar', 'Garden', 'Den']
+ARTIST_KINDS = ['Band', 'Trio', 'Collective', 'Brothers', 'Orchestra', 'Kids', 'Project', 'Ensemble']
+
+
+def seed(venues=1000, artists=1000, shows=10000, random_seed=0):
+    # Recreates the schema and fills it with reproducible data. Returns the
+    # seconds it took.
+    started_at = time.perf_counter()
+    rng = random.Random(random_seed)
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.commit()
+    db.drop_all()
+    db.create_all()
+
+    genre_names = [choice.value for choice in GenreChoice]
+    insert(Genre.__table__, ({'id': i + 1, 'name': name} for i, name in enumerate(genre_names)))
+    insert(Venue.__table__, (venue_row(rng, i + 1) for i in range(venues)))
+    insert(Artist.__table__, (artist_row(rng, i + 1) for i in range(artists)))
+    insert(venue_genres, genre_links(rng, 'venue_id', venues, len(genre_names)))
+    insert(artist_genres, genre_links(rng, 'artist_id', artists, len(genre_names)))
+
+    insert(Show.__table__, show_rows(rng, venues, artists, shows))
+    rebuild_show_counters()
+    refresh_matches()
+    db.session.commit()
+    if db.engine.dialect.name in ('postgresql', 'sqlite'):
+        db.session.execute(text('ANALYZE'))
+    db.session.commit()
+    cache.clear()
+    return time.perf_counter() - started_at
+
+
+def venue_row(rng, venue_id):
+    city, state = rng.choice(CITIES)
+    # Scattered over about 30 x 30 km around the city centre, from a
+    # separate generator so the rest of the data does not depend on it.
+    offsets = random.Random(venue_id)
+    latitude = CITY_LOCATIONS[city][0] + offsets.uniform(-0.135, 0.135)
+    longitude = CITY_LOCATIONS[city][1] + offsets.uniform(-0.17, 0.17)
+    return {
+        'id': venue_id,
+        'name': 'The %s %s %d' % (rng.choice(WORDS), rng.choice(VENUE_KINDS), venue_id),
+        'city': city,
+        'state': state,
+        'address': '%d %s Street' % (rng.randint(1, 9999), rng.choice(WORDS)),
+        'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(200, 999), rng.randint(0, 9999)),
+        'image_link': 'https://example.com/venues/%d.jpg' % venue_id,
+        'facebook_link': 'https://www.facebook.com/venue%d' % venue_id,
+        'website_link': 'https://venue%d.example.com' % venue_id,
+        'seeking_talent': rng.random() < 0.5,
+        'seeking_description': 'Looking for local acts.',
+        'latitude': latitude,
+        'longitude': longitude,
+        'geohash': geo.encode(latitude, longitude),
+    }
+
+
+def artist_row(rng, artist_id):
+    city, state = rng.choice(CITIES)
+    return {
+        'id': artist_id,
+        'name': '%s %s %s %d' % (rng.choice(WORDS), rng.choice(WORDS), rng.choice(ARTIST_KINDS), artist_id),
+        'city': city,
+        'state': state,
+        'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(200, 999), rng.randint(0, 9999)),
+        'image_link': 'https://example.com/artists/%d.jpg' % artist_id,
+        'facebook_link': 'https://www.facebook.com/artist%d' % artist_id,
+        'website': 'https://artist%d.example.com' % artist_id,
+        'seeking_venue': rng.random() < 0.5,
+        'seeking_description': 'Looking for a stage.',
+    }
+
+
+def genre_links(rng, owner_column, owners, genres):
+    for owner_id in range(1, owners + 1):
+        for genre_id in rng.sample(range(1, genres + 1), rng.randint(1, 3)):
+            yield {owner_column: owner_id, 'genre_id': genre_id}
+
+
+def show_rows(rng, venues, artists, shows):
+    # Three years of history and one year ahead, at most one evening show
+    # per venue and per artist a day, so no two shows of either overlap.
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    days = range(-365 * 3, 365)
+    booked = set()
+    for _ in range(min(shows, venues * len(days), artists * len(days))):
+        while True:
+            venue_id, artist_id, day = rng.randint(1, venues), rng.randint(1, artists), rng.choice(days)
+            if ('venue', venue_id, day) not in booked and ('artist', artist_id, day) not in booked:
+                break
+        booked.update([('venue', venue_id, day), ('artist', artist_id, day)])
+        start_time = today + timedelta(days=day, hours=rng.randint(18, 21))
+        yield {
+            'venue_id': venue_id,
+            'artist_id': artist_id,
+            'start_time': start_time,
+            'end_time': start_time + DEFAULT_SHOW_DURATION,
+        }
+
+
+def insert(table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            db.session.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+    db.session.commit()
+    if 'id' in table.c and db.engine.dialect.name == 'postgresql':
+        # Explicit ids leave the sequence behind; later inserts need it.
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), (SELECT COALESCE(MAX(id), 1) FROM \"%s\"))"
+            % (table.name, table.name)
+        ))
+        db.session.commit()
+
+
+def main():
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Fill a database with synthetic venues, artists and shows.')
+    parser.add_argument('database_uri')
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--random-seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database_uri
+    with app.app_context():
+        elapsed = seed(args.venues, args.artists, args.shows, args.random_seed)
+    print('Seeded %d venues, %d artists and %d shows in %.1fs.' % (args.venues, args.artists, args.shows, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+# ---------------------------------------------------------------------------- #
+# Route benchmark suite.
+#
+# Usage: python -m benchmarks.suite [--database URI] [--venues N] [--artists N]
+#                                   [--shows N] [--iterations N] [--cache BACKEND]
+#                                   [--output PATH] [--compare BASELINE]
+#
+# Seeds the database (SQLite in memory by default; any existing tables are
+# dropped), requests every route through the test client and reports
+# p50/p95 latency, queries per request and peak memory per route. Results
+# are written as JSON; --compare exits non-zero when a route issues more
+# queries than in the baseline or its p95 grew by more than --threshold.
+# ---------------------------------------------------------------------------- #
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+
+from app import app
+from benchmarks.seed import seed
+from cache import cache
+from models import db
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+IGNORED_ENDPOINTS = {'static', 'asset'}
+# p95 changes smaller than this are timer noise, whatever the threshold.
+MIN_REGRESSION_MS = 1.0
+
+
+def venue_form(i):
+    return {
+        'name': 'Benchmark Venue %d' % i, 'city': 'Austin', 'state': 'TX', 'address': '1 Main Street',
+        'phone': '512-555-0100', 'image_link': '', 'facebook_link': '', 'website_link': '',
+        'seeking_talent': 'y', 'seeking_description': '', 'genres': ['Jazz', 'Folk'],
+    }
+
+
+def artist_form(i):
+    return {
+        'name': 'Benchmark Artist %d' % i, 'city': 'Austin', 'state': 'TX', 'phone': '512-555-0101',
+        'image_link': '', 'facebook_link': '', 'website_link': '',
+        'seeking_venue': 'y', 'seeking_description': '', 'genres': ['Jazz'],
+    }
+
+
+def routes(venues, artists):
+    # (method, endpoint, path(i), form(i)) for every route; i is the
+    # iteration number, so writes and deletes touch a different row each
+    # time. Reads stay on the first rows, which the writes never change.
+    week = datetime.utcnow().replace(microsecond=0)
+    return [
+        ('GET', 'index', lambda i: '/', None),
+        ('GET', 'venues', lambda i: '/venues', None),
+        ('GET', 'venues_by_genre', lambda i: '/venues/genres/Jazz', None),
+        ('POST', 'search_venues', lambda i: '/venues/search', lambda i: {'search_term': 'blue'}),
+        ('GET', 'show_venue', lambda i: '/venues/1', None),
+        ('GET', 'create_venue_form', lambda i: '/venues/create', None),
+        ('POST', 'create_venue_submission', lambda i: '/venues/create', venue_form),
+        ('GET', 'edit_venue', lambda i: '/venues/2/edit', None),
+        ('POST', 'edit_venue_submission', lambda i: '/venues/%d/edit' % (3 + i % 10), venue_form),
+        ('DELETE', 'delete_venue', lambda i: '/venues/%d' % (venues - i), None),
+        ('GET', 'artists', lambda i: '/artists', None),
+        ('GET', 'artists_by_genre', lambda i: '/artists/genres/Jazz', None),
+        ('POST', 'search_artists', lambda i: '/artists/search', lambda i: {'search_term': 'blue'}),
+        ('GET', 'show_artist', lambda i: '/artists/1', None),
+        ('GET', 'create_artist_form', lambda i: '/artists/create', None),
+        ('POST', 'create_artist_submission', lambda i: '/artists/create', artist_form),
+        ('GET', 'edit_artist', lambda i: '/artists/2/edit', None),
+        ('POST', 'edit_artist_submission', lambda i: '/artists/%d/edit' % (3 + i % 10), artist_form),
+        ('GET', 'shows', lambda i: '/shows', None),
+        ('GET', 'create_shows', lambda i: '/shows/create', None),
+        ('POST', 'create_show_submission', lambda i: '/shows/create', lambda i: {
+            'venue_id': str(1 + i % venues), 'artist_id': str(1 + i % artists),
+            'start_time': '2030-01-01 20:00:00',
+        }),
+        ('GET', 'export_catalog', lambda i: '/export/venues.csv', None),
+        ('GET', 'api.list_venues', lambda i: '/api/v1/venues?limit=50', None),
+        ('GET', 'api.list_venues_near', lambda i: '/api/v1/venues/near?lat=30.27&lng=-97.74&limit=20', None),
+        ('GET', 'api.get_venue', lambda i: '/api/v1/venues/1', None),
+        ('GET', 'api.list_artists', lambda i: '/api/v1/artists?ids=' + ','.join(map(str, range(1, 51))), None),
+        ('GET', 'api.get_artist', lambda i: '/api/v1/artists/1', None),
+        ('GET', 'api.list_shows', lambda i: '/api/v1/shows', None),
+        ('GET', 'api.list_shows_in_window', lambda i: '/api/v1/shows/window?start=%s&end=%s&city=Austin&state=TX' % (
+            week.isoformat(), (week + timedelta(days=7)).isoformat()), None),
+        ('GET', 'api.list_venue_next_shows', lambda i: '/api/v1/venues/1/next-shows', None),
+        ('GET', 'api.list_artist_next_shows', lambda i: '/api/v1/artists/1/next-shows', None),
+        ('GET', 'api.list_artist_matches', lambda i: '/api/v1/artists/1/matches', None),
+        ('GET', 'api.list_venue_matches', lambda i: '/api/v1/venues/1/matches', None),
+        ('GET', 'admin.cache_stats', lambda i: '/admin/cache', None),
+        ('GET', 'admin.pool_stats', lambda i: '/admin/pool', None),
+        ('GET', 'admin.job_stats', lambda i: '/admin/jobs', None),
+        ('GET', 'admin.replica_stats', lambda i: '/admin/replicas', None),
+    ]
+
+
+def request(client, method, path, form):
+    # Returns the status and the number of statements issued. The body is
+    # read inside the measurement so streamed responses are fully produced.
+    # Statements of background job workers are not counted.
+    statements = []
+    thread = threading.get_ident()
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append(statement)
+
+    engine = db.get_engine()
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        response = client.open(path, method=method, data=form)
+        response.get_data()
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    return response.status_code, len(statements)
+
+
+def benchmark_route(client, method, endpoint, path, form, iterations):
+    form = form or (lambda i: None)
+    request(client, method, path(iterations), form(iterations))  # warm up
+
+    timings = []
+    queries = []
+    statuses = set()
+    for i in range(iterations):
+        started_at = time.perf_counter()
+        status, count = request(client, method, path(i), form(i))
+        timings.append((time.perf_counter() - started_at) * 1000)
+        queries.append(count)
+        statuses.add(status)
+
+    # Measured separately: tracing allocations slows everything down.
+    tracemalloc.start()
+    try:
+        request(client, method, path(iterations + 1), form(iterations + 1))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'method': method,
+        'endpoint': endpoint,
+        'path': path(0),
+        'statuses': sorted(statuses),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile.
+    return sorted_values[max(0, int(math.ceil(p / 100.0 * len(sorted_values))) - 1)]
+
+
+def route_name(result):
+    return '%s %s' % (result['method'], result['endpoint'])
+
+
+def unbenchmarked_routes(benchmarked):
+    registered = set(
+        (method, rule.endpoint) for rule in app.url_map.iter_rules() if rule.endpoint not in IGNORED_ENDPOINTS
+        for method in rule.methods - {'HEAD', 'OPTIONS'}
+    )
+    return sorted('%s %s' % route for route in registered - benchmarked)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    previous = dict((route_name(result), result) for result in baseline['routes'])
+    regressions = 0
+    print('\nCompared with %s:' % (baseline['meta'].get('commit') or 'baseline'))
+    for result in results['routes']:
+        before = previous.get(route_name(result))
+        if before is None:
+            continue
+        slower = result['p95_ms'] > before['p95_ms'] * (1 + threshold) \
+            and result['p95_ms'] - before['p95_ms'] > MIN_REGRESSION_MS
+        more_queries = result['queries'] > before['queries']
+        if slower or more_queries:
+            regressions += 1
+            print('  REGRESSION %-40s p95 %.1f -> %.1f ms, queries %d -> %d' % (
+                route_name(result), before['p95_ms'], result['p95_ms'], before['queries'], result['queries']
+            ))
+    if not regressions:
+        print('  no regressions')
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark every route against synthetic data.')
+    parser.add_argument('--database', default='sqlite://', help='Database URI (its tables are recreated).')
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=20000)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--cache', default='null', choices=['null', 'lru', 'dbm', 'redis'],
+                        help='Cache backend; the default measures uncached requests.')
+    parser.add_argument('--output', help='Defaults to benchmarks/results/<commit>.json.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Results file to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed relative p95 growth.')
+    args = parser.parse_args(argv)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+    app.config['CACHE_BACKEND'] = args.cache
+    app.config['ADMIN_TOKEN'] = 'benchmark'
+    cache.init_app(app)
+    # Per-request log lines would drown the results; only keep errors.
+    app.logger.setLevel(logging.ERROR)
+
+    results = {'meta': {}, 'routes': []}
+    with app.app_context():
+        seed_seconds = seed(args.venues, args.artists, args.shows)
+        client = app.test_client()
+        client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer benchmark'
+        for method, endpoint, path, form in routes(args.venues, args.artists):
+            result = benchmark_route(client, method, endpoint, path, form, args.iterations)
+            results['routes'].append(result)
+            print('%-40s p50 %8.2f ms  p95 %8.2f ms  %4d queries  %9.1f KB  %s' % (
+                route_name(result), result['p50_ms'], result['p95_ms'], result['queries'],
+                result['peak_memory_kb'], ','.join(map(str, result['statuses']))
+            ))
+        dialect = db.engine.dialect.name
+
+    commit = git_commit()
+    results['meta'] = {
+        'commit': commit,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'database': dialect,
+        'venues': args.venues,
+        'artists': args.artists,
+        'shows': args.shows,
+        'iterations': args.iterations,
+        'cache': args.cache,
+        'seed_seconds': round(seed_seconds, 3),
+    }
+    results['unbenchmarked'] = unbenchmarked_routes(set(
+        (result['method'], result['endpoint']) for result in results['routes']
+    ))
+    for name in results['unbenchmarked']:
+        print('not benchmarked: %s' % name)
+
+    output = args.output or os.path.join(RESULTS_DIR, '%s.json' % (commit or 'results'))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as destination:
+        json.dump(results, destination, indent=2)
+    print('Wrote %s' % output)
+
+    if args.compare:
+        with open(args.compare) as source:
+            if compare(results, json.load(source), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
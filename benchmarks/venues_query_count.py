@@ -0,0 +1,53 @@
+# ---------------------------------------------------------------------------- #
+# Query count of the /venues listing as the number of venues grows.
+#
+# Usage: python -m benchmarks.venues_query_count [sizes...]
+# ---------------------------------------------------------------------------- #
+import sys
+
+from sqlalchemy import event
+
+from app import app
+from benchmarks.seed import seed
+from models import db
+
+DEFAULT_SIZES = [10, 100, 1000]
+
+
+def count_queries(client, path):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.get_engine()
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    assert response.status_code == 200, response.status_code
+    return len(statements)
+
+
+def main(sizes):
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    results = []
+    with app.app_context():
+        client = app.test_client()
+        for size in sizes:
+            seed(venues=size, artists=10, shows=size * 2)
+            results.append((size, count_queries(client, '/venues')))
+
+    print('%10s %10s' % ('venues', 'queries'))
+    for size, queries in results:
+        print('%10d %10d' % (size, queries))
+
+    if len(set(queries for _, queries in results)) != 1:
+        print('Query count grows with the number of venues.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES))
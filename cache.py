@@ -0,0 +1,279 @@
+# ---------------------------------------------------------------------------- #
+# Cache.
+# ---------------------------------------------------------------------------- #
+import fcntl
+import math
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class LRUBackend:
+    # In-process store evicting the least recently used entry once full.
+    # Every process has its own, so an invalidation is only seen by the
+    # process that made it.
+    shared = False
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl=None):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _dbm_module():
+    # dbm.dumb, the fallback of the dbm package, reads its whole index on
+    # every open: tens of milliseconds per lookup, slower than the queries
+    # it would save.
+    for name in ('dbm.gnu', 'dbm.ndbm'):
+        try:
+            return __import__(name, fromlist=['open'])
+        except ImportError:
+            pass
+    raise ValueError('CACHE_BACKEND=dbm needs Python built with dbm.gnu or dbm.ndbm; use lru or redis.')
+
+
+class DbmBackend:
+    # Local file store shared by every process on the host. The file is
+    # opened per operation under an flock on a separate lock file (shared
+    # for reads, exclusive for writes), since a thread lock does not
+    # protect it across processes. The file only grows until it is
+    # rewritten, so a write rewrites it without the expired entries every
+    # compact_interval seconds.
+    shared = True
+
+    def __init__(self, path, compact_interval=600):
+        self.dbm = _dbm_module()
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.compact_interval = compact_interval
+        with self._locked(fcntl.LOCK_EX):
+            self.dbm.open(self.path, 'c').close()
+
+    @contextmanager
+    def _locked(self, operation):
+        # A lock file opened per operation, so that the threads of a
+        # process exclude each other too.
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key):
+        with self._locked(fcntl.LOCK_SH), self.dbm.open(self.path, 'r') as store:
+            value = store.get(key)
+        if value is None:
+            return None
+        expires_at, entry = pickle.loads(value)
+        return entry if expires_at is None or expires_at > time.time() else None
+
+    def set(self, key, entry, ttl=None):
+        with self._locked(fcntl.LOCK_EX):
+            with self.dbm.open(self.path, 'w') as store:
+                store[key] = pickle.dumps((time.time() + ttl if ttl else None, entry))
+                marker = store.get('__compacted_at__')
+            compacted_at = pickle.loads(marker)[1] if marker is not None else 0
+            if compacted_at + self.compact_interval <= time.time():
+                self._compact()
+
+    def _compact(self):
+        now = time.time()
+        with self.dbm.open(self.path, 'r') as store:
+            entries = dict((key, store[key]) for key in store.keys())
+        with self.dbm.open(self.path, 'n') as store:
+            for key, value in entries.items():
+                expires_at, entry = pickle.loads(value)
+                if expires_at is None or expires_at > now:
+                    store[key] = value
+            store['__compacted_at__'] = pickle.dumps((None, now))
+
+    def delete(self, key):
+        with self._locked(fcntl.LOCK_EX), self.dbm.open(self.path, 'w') as store:
+            if key in store:
+                del store[key]
+
+    def clear(self):
+        with self._locked(fcntl.LOCK_EX):
+            self.dbm.open(self.path, 'n').close()
+
+    def __len__(self):
+        with self._locked(fcntl.LOCK_SH), self.dbm.open(self.path, 'r') as store:
+            return len(store)
+
+
+class RedisBackend:
+    # Redis (or any server speaking its protocol), shared by every process
+    # of every host. Entries expire on the server, so orphaned ones go away
+    # on their own; keys carry a prefix so that clear() leaves the rest of
+    # the database alone.
+    shared = True
+
+    def __init__(self, url, prefix='fyyur:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, entry, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(entry), ex=max(int(math.ceil(ttl)), 1) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*', count=1000))
+        for start in range(0, len(keys), 1000):
+            self.client.delete(*keys[start:start + 1000])
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*', count=1000))
+
+
+class NullBackend:
+    # Nothing is cached, so nothing can be stale in any process.
+    shared = True
+
+    def get(self, key):
+        return None
+
+    def set(self, key, entry, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class Cache:
+    # Entries live in namespaces ('venues', 'venue:3', ...). Invalidating a
+    # namespace gives it a fresh random generation, which orphans every key
+    # built under the previous one; orphans then age out through the LRU,
+    # the expiry of the Redis keys or the compaction of the dbm file. A
+    # generation that was evicted is replaced rather than reset, so an old
+    # entry can never become visible again.
+
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.ttl = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('CACHE_BACKEND', 'null')
+        if backend == 'lru':
+            self.backend = LRUBackend(app.config.get('CACHE_MAX_ENTRIES', 1024))
+        elif backend == 'dbm':
+            self.backend = DbmBackend(app.config['CACHE_DBM_PATH'], app.config.get('CACHE_DBM_COMPACT_INTERVAL', 600))
+        elif backend == 'redis':
+            if not app.config.get('CACHE_REDIS_URL'):
+                raise ValueError('CACHE_BACKEND=redis needs CACHE_REDIS_URL or REDIS_URL.')
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        elif backend == 'null':
+            self.backend = NullBackend()
+        else:
+            raise ValueError('Unknown CACHE_BACKEND: %s' % backend)
+        self.ttl = app.config.get('CACHE_TTL', 300)
+        app.extensions['cache'] = self
+
+    def memoize(self, namespace, key, compute):
+        full_key = '%s:%s:%s' % (namespace, self._generation(namespace), key)
+        entry = self.backend.get(full_key)
+        if entry is not None and entry[0] > time.time():
+            self._count('hits')
+            return entry[1]
+
+        self._count('misses')
+        value = compute()
+        self.backend.set(full_key, (time.time() + self.ttl, value), self.ttl)
+        return value
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.set(self._generation_key(namespace), os.urandom(4).hex())
+            self._count('invalidations')
+        self.backend.set('__invalidated_at__', time.time())
+
+    def invalidated_at(self):
+        # When a namespace was last invalidated, 0 if unknown.
+        return self.backend.get('__invalidated_at__') or 0
+
+    def clear(self):
+        self.backend.clear()
+
+    @property
+    def shared(self):
+        # Whether every process sees the same entries and invalidations.
+        return self.backend.shared
+
+    def version(self, *namespaces):
+        # Changes whenever one of the namespaces is invalidated.
+        return '.'.join(self._generation(namespace) for namespace in namespaces)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'invalidations': self.invalidations,
+        }
+
+    def _generation(self, namespace):
+        generation = self.backend.get(self._generation_key(namespace))
+        if generation is None:
+            generation = os.urandom(4).hex()
+            self.backend.set(self._generation_key(namespace), generation)
+        return generation
+
+    def _generation_key(self, namespace):
+        return '__generation__:%s' % namespace
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+cache = Cache()
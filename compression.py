@@ -0,0 +1,60 @@
+# ---------------------------------------------------------------------------- #
+# Response compression.
+#
+# Buffered responses of a COMPRESS_MIMETYPES type and at least
+# COMPRESS_MIN_SIZE bytes are sent brotli- or gzip-compressed, whichever the
+# client prefers (brotli on a tie). Streamed responses, files sent by the
+# static routes and responses that already carry a Content-Encoding (e.g.
+# the precompressed assets) pass through untouched.
+# ---------------------------------------------------------------------------- #
+import gzip
+
+import brotli
+from flask import request
+
+
+class Compressor:
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        self.mimetypes = set(app.config.get('COMPRESS_MIMETYPES', ['text/html']))
+        self.gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+        self.brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 5)
+        app.after_request(self.compress)
+        app.extensions['compressor'] = self
+
+    def compress(self, response):
+        if (response.mimetype not in self.mimetypes or response.direct_passthrough or response.is_streamed
+                or not 200 <= response.status_code < 300 or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose_encoding()
+        data = response.get_data()
+        if encoding is None or len(data) < self.min_size:
+            return response
+
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=self.brotli_quality))
+        else:
+            response.set_data(gzip.compress(data, self.gzip_level))
+        response.headers['Content-Encoding'] = encoding
+        # A strong ETag names these exact bytes; the compressed body is a
+        # different representation.
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def choose_encoding(self):
+        accepted = request.accept_encodings
+        brotli_quality, gzip_quality = accepted['br'], accepted['gzip']
+        if not brotli_quality and not gzip_quality:
+            return None
+        return 'br' if brotli_quality >= gzip_quality else 'gzip'
+
+
+compressor = Compressor()
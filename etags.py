@@ -0,0 +1,144 @@
+# ---------------------------------------------------------------------------- #
+# Conditional GET for the HTML pages.
+#
+# The weak ETag of a page in PAGE_SOURCES is derived from the rows behind
+# it: the TableVersion counter of the tables it lists, and MAX(updated_at)
+# and COUNT(*) of the few rows of a detail page (the count catches
+# deletions), all read in one statement through primary keys and indexes.
+# It also folds in the query string, a CACHE_TTL time bucket for the
+# upcoming and past show split, and a digest of the templates and modules,
+# so a deploy never answers 304 with an old layout. If-None-Match is checked
+# in before_request, so a match is answered before the view queries or
+# renders anything.
+#
+# The views key their cached view models with the same version
+# (page_etags.version()), so a body is never older than its ETag, even
+# when another process cached it before a write it has not heard about.
+# ---------------------------------------------------------------------------- #
+import glob
+import hashlib
+import json
+import os
+import time
+
+from flask import g, request, session
+from sqlalchemy import func, select
+
+from models import Venue, Artist, Show, TableVersion, db
+
+
+def venue_page_sources(venue_id):
+    return [
+        (Venue, Venue.id == venue_id),
+        (Show, Show.venue_id == venue_id),
+        (Artist, Artist.id.in_(select(Show.artist_id).where(Show.venue_id == venue_id))),
+    ]
+
+
+def artist_page_sources(artist_id):
+    return [
+        (Artist, Artist.id == artist_id),
+        (Show, Show.artist_id == artist_id),
+        (Venue, Venue.id.in_(select(Show.venue_id).where(Show.artist_id == artist_id))),
+    ]
+
+
+# Endpoint -> function of the view arguments returning the sources of the
+# page: models, for every row of their table, or (model, *criteria).
+PAGE_SOURCES = {
+    'venues': lambda: [Venue],
+    'venues_by_genre': lambda genre: [Venue],
+    'artists': lambda: [Artist],
+    'artists_by_genre': lambda genre: [Artist],
+    'shows': lambda: [Show, Venue, Artist],
+    'show_venue': venue_page_sources,
+    'show_artist': artist_page_sources,
+}
+
+
+def sources_version(sources):
+    # Criteria must select few rows through an index: their MAX(updated_at)
+    # and COUNT(*) are computed on every request.
+    columns = []
+    for source in sources:
+        if not isinstance(source, tuple):
+            columns.append(
+                select(TableVersion.version).where(TableVersion.table_name == source.__tablename__).scalar_subquery()
+            )
+            continue
+        model, *criteria = source
+        columns.append(select(func.max(model.updated_at)).where(*criteria).scalar_subquery())
+        columns.append(select(func.count()).select_from(model).where(*criteria).scalar_subquery())
+    return '|'.join(str(value) for value in db.session.execute(select(*columns)).one())
+
+
+class PageETags:
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = max(app.config.get('CACHE_TTL', 300), 1)
+        self.build = None
+        app.before_request(self.check)
+        app.after_request(self.tag)
+        app.teardown_request(self.forget)
+        app.extensions['etags'] = self
+
+    def build_version(self):
+        # Recomputed on every request while templates are reloaded, i.e.
+        # during development.
+        if self.build is None or self.app.jinja_env.auto_reload:
+            digest = hashlib.sha1()
+            paths = glob.glob(os.path.join(self.app.root_path, '*.py'))
+            paths += glob.glob(os.path.join(self.app.root_path, self.app.template_folder, '**', '*.html'), recursive=True)
+            for path in sorted(paths):
+                with open(path, 'rb') as source:
+                    digest.update(source.read())
+            assets = self.app.extensions.get('assets')
+            if assets is not None:
+                digest.update(json.dumps(assets.manifest, sort_keys=True).encode())
+            self.build = digest.hexdigest()
+        return self.build
+
+    def version(self, endpoint=None, **view_args):
+        # Version of the rows behind a page and of the time bucket; that of
+        # the current page is computed once per request.
+        if endpoint is None:
+            if 'page_version' not in g:
+                g.page_version = self.version(request.endpoint, **request.view_args)
+            return g.page_version
+        sources = PAGE_SOURCES[endpoint](**view_args)
+        return '%s|%d' % (sources_version(sources), time.time() // self.ttl)
+
+    def check(self):
+        if request.method != 'GET' or request.endpoint not in PAGE_SOURCES:
+            return None
+        if '_flashes' in session:
+            # Pending flash messages are part of the page.
+            return None
+        g.page_etag = hashlib.sha1(('%s|%s|%s' % (
+            self.build_version(), request.full_path, self.version()
+        )).encode()).hexdigest()
+        if request.if_none_match.contains_weak(g.page_etag):
+            return self.app.response_class(status=304)
+        return None
+
+    def forget(self, exception=None):
+        # g outlives the request when an app context was already pushed,
+        # e.g. in scripts and tests.
+        g.pop('page_version', None)
+
+    def tag(self, response):
+        etag = g.pop('page_etag', None)
+        if etag is not None and response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            # Browsers may keep the page but must revalidate it every time.
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        return response
+
+
+page_etags = PageETags()
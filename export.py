@@ -0,0 +1,115 @@
+# ---------------------------------------------------------------------------- #
+# Bulk export.
+#
+# Usage: flask export venues
+#        flask export shows --format jsonl --output shows.jsonl.gz
+# ---------------------------------------------------------------------------- #
+import csv
+import io
+import json
+import zlib
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from models import Venue, Artist, Show, Genre, venue_genres, artist_genres, db
+
+FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+# Column names match what 'flask import' reads back.
+COLUMNS = {
+    'venues': ['id', 'name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+               'website_link', 'seeking_talent', 'seeking_description', 'genres'],
+    'artists': ['id', 'name', 'city', 'state', 'phone', 'image_link', 'facebook_link', 'website',
+                'seeking_venue', 'seeking_description', 'genres'],
+    'shows': ['id', 'venue_id', 'artist_id', 'start_time', 'end_time'],
+}
+
+
+def stream_rows(entity):
+    # Rows are fetched through a server-side cursor BATCH_SIZE at a time.
+    if entity == 'shows':
+        query = db.session.query(*[getattr(Show, column) for column in COLUMNS['shows']]).order_by(Show.id)
+    else:
+        model, association, owner_column = {
+            'venues': (Venue, venue_genres, venue_genres.c.venue_id),
+            'artists': (Artist, artist_genres, artist_genres.c.artist_id),
+        }[entity]
+        query = db.session.query(
+            *[getattr(model, column) for column in COLUMNS[entity][:-1]],
+            aggregate_names(Genre.name).label('genres')
+        ).outerjoin(association, owner_column == model.id)\
+            .outerjoin(Genre, Genre.id == association.c.genre_id)\
+            .group_by(model.id)\
+            .order_by(model.id)
+    return query.yield_per(BATCH_SIZE)
+
+
+def aggregate_names(column):
+    if db.engine.dialect.name == 'postgresql':
+        return func.string_agg(column, ',')
+    return func.group_concat(column, ',')
+
+
+def encode_rows(entity, rows, file_format):
+    columns = COLUMNS[entity]
+    if file_format == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), default=serialize) + '\n'
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([serialize(value) if value is not None else '' for value in row])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+def serialize(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def generate_export(entity, file_format):
+    # Gzip-compressed output produced in CHUNK_SIZE pieces, so memory use
+    # does not depend on the size of the table.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    pending = []
+    pending_size = 0
+    for line in encode_rows(entity, stream_rows(entity), file_format):
+        pending.append(line)
+        pending_size += len(line)
+        if pending_size >= CHUNK_SIZE:
+            chunk = compressor.compress(''.join(pending).encode('utf-8'))
+            pending = []
+            pending_size = 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(''.join(pending).encode('utf-8')) + compressor.flush()
+
+
+def export_filename(entity, file_format):
+    return '%s.%s.gz' % (entity, file_format)
+
+
+@click.command('export')
+@click.argument('entity', type=click.Choice(sorted(COLUMNS)))
+@click.option('--format', 'file_format', type=click.Choice(FORMATS), default='csv', show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False, writable=True),
+              help='Defaults to <entity>.<format>.gz in the current directory.')
+@with_appcontext
+def export_command(entity, file_format, output):
+    """Dump venues, artists or shows to a gzip-compressed CSV or JSONL file."""
+    output = output or export_filename(entity, file_format)
+    size = 0
+    with open(output, 'wb') as destination:
+        for chunk in generate_export(entity, file_format):
+            destination.write(chunk)
+            size += len(chunk)
+    click.echo('Wrote %s (%d bytes).' % (output, size))
@@ -1,8 +1,8 @@
 import enum
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, NumberRange
 
 
 class Genre(enum.Enum):
@@ -39,6 +39,11 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration = IntegerField(
+        'duration',
+        validators=[DataRequired(), NumberRange(min=1, max=24 * 60)],
+        default=120
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -0,0 +1,47 @@
+# ---------------------------------------------------------------------------- #
+# Fragment caching.
+#
+#   {% cache 'venues', request.full_path, page_version() %} ... {% endcache %}
+#
+# The rendered block is stored in the cache namespace named first, under
+# the name and a digest of the values that follow, which must identify
+# what the block renders: here the page and the version of its rows (see
+# etags.py), so the block is re-rendered as soon as they change, even in a
+# process that missed the invalidation. Every block costs a cache lookup,
+# so cache whole listings rather than their rows: rendering a row is
+# cheaper than fetching it.
+# ---------------------------------------------------------------------------- #
+import hashlib
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import cache
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache_enabled=True)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        namespace = parser.parse_expression()
+        parser.stream.expect('comma')
+        name = parser.parse_expression()
+        values = []
+        while parser.stream.skip_if('comma'):
+            values.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [namespace, name, nodes.List(values)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, namespace, name, values, caller):
+        if not self.environment.fragment_cache_enabled:
+            return caller()
+        key = 'fragment:%s:%s' % (name, hashlib.sha1(repr(values).encode()).hexdigest())
+        return Markup(cache.memoize(namespace, key, lambda: str(caller())))
@@ -0,0 +1,80 @@
+# ---------------------------------------------------------------------------- #
+# Geohashes and distances.
+#
+# A geohash interleaves the bits of longitude and latitude into a base32
+# string; every prefix names a rectangular cell containing all the longer
+# hashes that start with it. Stored next to the coordinates and indexed
+# with a plain B-tree, it turns "venues around a point" into a few
+# prefix range scans on any database (see queries.get_venues_near).
+# ---------------------------------------------------------------------------- #
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# 9 characters are cells of about 5 x 5 m.
+PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        # Even bits halve the longitude range, odd ones the latitude range.
+        if even:
+            middle = (west + east) / 2
+            value = value * 2 + (longitude >= middle)
+            west, east = (middle, east) if longitude >= middle else (west, middle)
+        else:
+            middle = (south + north) / 2
+            value = value * 2 + (latitude >= middle)
+            south, north = (middle, north) if latitude >= middle else (south, middle)
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    # (height, width) of the cells of a precision, in degrees.
+    longitude_bits = (5 * precision + 1) // 2
+    latitude_bits = 5 * precision // 2
+    return 180.0 / 2 ** latitude_bits, 360.0 / 2 ** longitude_bits
+
+
+def covering_cells(latitude, longitude, radius_km):
+    # The cell containing the point and its eight neighbours, at the finest
+    # precision whose cells are at least radius_km across: together they
+    # cover the whole circle.
+    precision = PRECISION
+    while precision > 1:
+        height, width = cell_size(precision)
+        # A cell is narrowest on the side nearest to the pole.
+        edge = min(abs(latitude) + height, 90.0)
+        if height * KM_PER_DEGREE >= radius_km and \
+                width * KM_PER_DEGREE * math.cos(math.radians(edge)) >= radius_km:
+            break
+        precision -= 1
+    height, width = cell_size(precision)
+    cells = set()
+    for row in (-1, 0, 1):
+        for column in (-1, 0, 1):
+            cell_latitude = max(-90.0, min(90.0, latitude + row * height))
+            cell_longitude = (longitude + column * width + 180.0) % 360.0 - 180.0
+            cells.add(encode(cell_latitude, cell_longitude, precision))
+    return sorted(cells)
+
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    # Great-circle (haversine) distance.
+    latitude, longitude, other_latitude, other_longitude = map(
+        math.radians, (latitude, longitude, other_latitude, other_longitude)
+    )
+    a = math.sin((other_latitude - latitude) / 2) ** 2 + \
+        math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,120 @@
+# ---------------------------------------------------------------------------- #
+# Offline batch geocoder.
+#
+# Usage: flask geocode gazetteer.tsv [--all] [--batch-size N]
+#
+# Places venues at the centre of their city, looked up by (city, state) in
+# a local gazetteer: the US Census Gazetteer places file
+# (2020_Gaz_place_national.txt) or any CSV/TSV file with city, state,
+# latitude and longitude columns. Only venues without coordinates are
+# looked up unless --all is given, so it can run after every import;
+# venues that change city lose their coordinates until the next run.
+# Located venues get a fresh updated_at, so every process serves their new
+# coordinates right away (see etags.py).
+# ---------------------------------------------------------------------------- #
+import csv
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam
+
+import geo
+from models import Venue, db, utcnow
+
+# Accepted header names of each gazetteer column, lower case.
+COLUMNS = {
+    'city': ('city', 'name', 'place'),
+    'state': ('state', 'usps', 'state_code'),
+    'latitude': ('latitude', 'lat', 'intptlat'),
+    'longitude': ('longitude', 'lng', 'lon', 'intptlong'),
+}
+# Kinds of place the Census Gazetteer appends to the names.
+PLACE_SUFFIX = re.compile(r'\s+(city|town|village|borough|municipality|cdp|consolidated government.*'
+                          r'|metropolitan government.*|unified government.*|urban county)$')
+
+
+def place_key(city, state):
+    city = re.sub(r'[^\w\s]', '', city.casefold())
+    city = re.sub(r'\s+', ' ', city).strip()
+    city = PLACE_SUFFIX.sub('', city)
+    city = re.sub(r'^saint ', 'st ', city)
+    return city, state.strip().upper()
+
+
+def load_gazetteer(path):
+    # (city, state) key -> (latitude, longitude). The first entry of a
+    # place wins.
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        dialect = csv.Sniffer().sniff(source.read(4096), delimiters=',\t|;')
+        source.seek(0)
+        reader = csv.reader(source, dialect)
+        header = [name.strip().lower() for name in next(reader)]
+        try:
+            indexes = dict(
+                (column, next(i for i, name in enumerate(header) if name in names))
+                for column, names in COLUMNS.items()
+            )
+        except StopIteration:
+            raise click.ClickException('%s needs city, state, latitude and longitude columns.' % path)
+
+        places = {}
+        for row in reader:
+            try:
+                key = place_key(row[indexes['city']], row[indexes['state']])
+                location = float(row[indexes['latitude']]), float(row[indexes['longitude']])
+            except (IndexError, ValueError):
+                continue
+            places.setdefault(key, location)
+    return places
+
+
+def geocode_venues(places, relocate=False, batch_size=1000):
+    # Returns the ids of the venues placed and the areas not found.
+    located = []
+    missing = set()
+    update = Venue.__table__.update()\
+        .where(Venue.id == bindparam('venue_id'))\
+        .values(latitude=bindparam('latitude'), longitude=bindparam('longitude'),
+                geohash=bindparam('geohash'), updated_at=bindparam('updated_at'))
+    after_id = 0
+    while True:
+        venues = db.session.query(Venue.id, Venue.city, Venue.state).filter(Venue.id > after_id)
+        if not relocate:
+            venues = venues.filter(Venue.latitude.is_(None))
+        venues = venues.order_by(Venue.id).limit(batch_size).all()
+        if not venues:
+            return located, missing
+        after_id = venues[-1].id
+
+        now = utcnow()
+        rows = []
+        for venue in venues:
+            location = places.get(place_key(venue.city or '', venue.state or ''))
+            if location is None:
+                missing.add((venue.city, venue.state))
+                continue
+            rows.append({
+                'venue_id': venue.id, 'latitude': location[0], 'longitude': location[1],
+                'geohash': geo.encode(*location), 'updated_at': now,
+            })
+        if rows:
+            db.session.execute(update, rows)
+            db.session.commit()
+            located.extend(row['venue_id'] for row in rows)
+
+
+@click.command('geocode')
+@click.argument('gazetteer', type=click.Path(exists=True, dir_okay=False))
+@click.option('--all', 'relocate', is_flag=True, help='Look up venues that already have coordinates too.')
+@click.option('--batch-size', default=1000, show_default=True, help='Venues updated per transaction.')
+@with_appcontext
+def geocode_command(gazetteer, relocate, batch_size):
+    """Fill in venue coordinates from a local gazetteer file."""
+    places = load_gazetteer(gazetteer)
+    located, missing = geocode_venues(places, relocate=relocate, batch_size=batch_size)
+    click.echo('Located %d venues with %d gazetteer places.' % (len(located), len(places)))
+    if missing:
+        click.echo('Not in the gazetteer: %s' % ', '.join(
+            '%s, %s' % area for area in sorted(missing, key=lambda area: (area[1] or '', area[0] or ''))
+        ))
@@ -0,0 +1,43 @@
+# ---------------------------------------------------------------------------- #
+# Gunicorn settings.
+#
+# Usage: gunicorn -c gunicorn.conf.py wsgi:application
+#
+# WEB_CONCURRENCY  worker processes (default: 2 per CPU + 1)
+# WEB_THREADS      threads per worker; keep DB_POOL_SIZE + DB_MAX_OVERFLOW
+#                  at least this high or threads queue for connections
+# PORT             port to listen on (default 8000)
+# ---------------------------------------------------------------------------- #
+import multiprocessing
+import os
+import time
+
+started_at = time.perf_counter()
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = 5
+# Recycle workers now and then so slow leaks cannot accumulate.
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+# Load the app once in the master; workers are forked from it.
+preload_app = True
+accesslog = '-'
+
+
+def when_ready(server):
+    server.log.info('Master ready in %.1f ms', (time.perf_counter() - started_at) * 1000)
+
+
+def post_fork(server, worker):
+    from wsgi import warm_up_worker
+
+    report = warm_up_worker()
+    server.log.info(
+        'Worker %s ready in %.1f ms (%d connections opened in %.1f ms)',
+        worker.pid, (time.perf_counter() - started_at) * 1000, report['connections'], report['pool_warm_up_ms']
+    )
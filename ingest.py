@@ -0,0 +1,335 @@
+# ---------------------------------------------------------------------------- #
+# Bulk import.
+#
+# Usage: flask import venues venues.csv
+#        flask import artists artists.jsonl --batch-size 5000
+#        flask import shows shows.csv.gz
+#
+# Imported rows get a fresh updated_at, which changes the row versions the
+# cached pages are keyed with (see etags.py): every process serves them as
+# soon as they are committed, without clearing any cache.
+# ---------------------------------------------------------------------------- #
+import bisect
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import click
+import dateutil.parser
+from flask.cli import with_appcontext
+from sqlalchemy import tuple_
+
+from queries import as_utc
+from show_counters import refresh_show_counters
+from models import Venue, Artist, Show, Genre, venue_genres, artist_genres, db, DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION
+
+TRUE_VALUES = ('y', 'yes', 'true', 't', '1')
+
+
+class Entity:
+    # How one kind of row is parsed, deduplicated and written.
+
+    def __init__(self, model, natural_key, columns, booleans=(), genres=None):
+        self.model = model
+        self.table = model.__table__
+        self.natural_key = natural_key
+        self.columns = columns
+        self.booleans = booleans
+        self.genres = genres
+
+    def key_columns(self):
+        return tuple_(*[self.table.c[name] for name in self.natural_key])
+
+    def key(self, row):
+        return tuple(row[name] for name in self.natural_key)
+
+
+ENTITIES = {
+    'venues': Entity(
+        Venue,
+        ('name', 'city', 'state'),
+        ['name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link', 'website_link',
+         'seeking_talent', 'seeking_description'],
+        booleans=['seeking_talent'],
+        genres=(venue_genres, 'venue_id'),
+    ),
+    'artists': Entity(
+        Artist,
+        ('name', 'city', 'state'),
+        ['name', 'city', 'state', 'phone', 'image_link', 'facebook_link', 'website',
+         'seeking_venue', 'seeking_description'],
+        booleans=['seeking_venue'],
+        genres=(artist_genres, 'artist_id'),
+    ),
+    'shows': Entity(
+        Show,
+        ('venue_id', 'artist_id', 'start_time'),
+        ['venue_id', 'artist_id', 'start_time', 'end_time'],
+    ),
+}
+
+
+@click.command('import')
+@click.argument('entity', type=click.Choice(sorted(ENTITIES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, show_default=True, help='Rows written per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of a previous failed run.')
+@with_appcontext
+def import_command(entity, path, batch_size, restart):
+    """Bulk load venues, artists or shows from a CSV or JSONL file.
+
+    Rows whose natural key is already stored are skipped, so a file can be
+    imported more than once. Progress is checkpointed after every batch:
+    rerunning a failed import resumes at the batch that failed. Shows that
+    overlap another show of their venue or artist are rejected.
+    """
+    entity = ENTITIES[entity]
+    checkpoint = Checkpoint(path)
+    skip = 0 if restart else checkpoint.load()
+    if skip:
+        click.echo('Resuming after row %d.' % skip)
+
+    totals = {'read': skip, 'inserted': 0, 'skipped': 0, 'rejected': 0}
+    started_at = time.perf_counter()
+    for batch in batches(read_rows(path), batch_size, skip):
+        try:
+            counts = import_batch(entity, batch)
+        except Exception as e:
+            db.session.rollback()
+            raise click.ClickException(
+                'Batch starting at row %d failed: %s\nRerun the same command to resume from it.'
+                % (totals['read'] + 1, e)
+            )
+        totals['read'] += len(batch)
+        for name, count in counts.items():
+            totals[name] += count
+        checkpoint.save(totals['read'])
+        click.echo(progress(totals, totals['read'] - skip, time.perf_counter() - started_at))
+
+    checkpoint.clear()
+    click.echo('Done. ' + progress(totals, totals['read'] - skip, time.perf_counter() - started_at))
+
+
+def import_batch(entity, raw_rows):
+    rows, rejected = parse_rows(entity, raw_rows)
+    if entity.model is Show:
+        rows, unresolved = resolve_show_references(rows)
+        rejected += unresolved
+
+    # Natural-key deduplication, within the batch and against the table.
+    unique_rows = {}
+    for row in rows:
+        unique_rows.setdefault(entity.key(row), row)
+    # SQLite returns stored times naive; rows carry them as aware UTC.
+    existing = set(
+        tuple(as_utc(value) if isinstance(value, datetime) else value for value in key)
+        for key in db.session.query(*entity.key_columns().clauses)
+        .filter(entity.key_columns().in_(list(unique_rows)))
+    )
+    new_rows = [row for key, row in unique_rows.items() if key not in existing]
+    skipped = len(rows) - len(new_rows)
+    if entity.model is Show:
+        new_rows, overlapping = reject_overlapping_shows(new_rows)
+        rejected += overlapping
+
+    if new_rows:
+        # A single executemany for the whole batch.
+        db.session.execute(entity.table.insert(), [
+            dict((column, row.get(column)) for column in entity.columns) for row in new_rows
+        ])
+        if entity.genres is not None:
+            insert_genres(entity, new_rows)
+        if entity.model is Show:
+            refresh_show_counters(
+                [row['venue_id'] for row in new_rows], [row['artist_id'] for row in new_rows]
+            )
+    db.session.commit()
+    return {'inserted': len(new_rows), 'skipped': skipped, 'rejected': rejected}
+
+
+def parse_rows(entity, raw_rows):
+    rows = []
+    rejected = 0
+    for raw in raw_rows:
+        row = dict((name, value if value != '' else None) for name, value in raw.items())
+        for name in entity.booleans:
+            row[name] = str(row.get(name) or '').strip().lower() in TRUE_VALUES
+        if entity.model is Show:
+            if not row.get('start_time'):
+                rejected += 1
+                continue
+            row['start_time'] = as_utc(dateutil.parser.parse(row['start_time']))
+            if row.get('end_time'):
+                row['end_time'] = as_utc(dateutil.parser.parse(row['end_time']))
+            else:
+                row['end_time'] = row['start_time'] + DEFAULT_SHOW_DURATION
+            if not timedelta(0) < row['end_time'] - row['start_time'] <= MAX_SHOW_DURATION:
+                rejected += 1
+                continue
+        elif not row.get('name'):
+            rejected += 1
+            continue
+        if entity.genres is not None:
+            genres = row.get('genres') or []
+            if isinstance(genres, str):
+                genres = genres.split(',')
+            row['genres'] = sorted(set(name.strip() for name in genres if name.strip()))
+        rows.append(row)
+    return rows, rejected
+
+
+def reject_overlapping_shows(rows):
+    # Drops shows overlapping a stored show or an earlier row of the batch
+    # for the same venue or artist. The stored shows that can overlap a row
+    # start less than MAX_SHOW_DURATION before it (see
+    # queries.find_show_conflict), so one ranged query per side loads all
+    # those of the batch; the checks then run in memory.
+    if not rows:
+        return rows, 0
+    after = min(row['start_time'] for row in rows) - MAX_SHOW_DURATION
+    before = max(row['end_time'] for row in rows)
+    shows = {}
+    for name, column in (('venue_id', Show.venue_id), ('artist_id', Show.artist_id)):
+        stored = db.session.query(column, Show.start_time, Show.end_time).filter(
+            column.in_(sorted(set(row[name] for row in rows))),
+            Show.start_time > after,
+            Show.start_time < before,
+        )
+        for owner_id, start_time, end_time in stored:
+            shows.setdefault((name, owner_id), []).append((as_utc(start_time), as_utc(end_time)))
+    for owner_shows in shows.values():
+        owner_shows.sort()
+
+    accepted = []
+    for row in rows:
+        owners = [(name, row[name]) for name in ('venue_id', 'artist_id')]
+        if not any(overlaps(shows.get(owner, []), row['start_time'], row['end_time']) for owner in owners):
+            accepted.append(row)
+            for owner in owners:
+                bisect.insort(shows.setdefault(owner, []), (row['start_time'], row['end_time']))
+    return accepted, len(rows) - len(accepted)
+
+
+def overlaps(owner_shows, start_time, end_time):
+    # owner_shows is sorted by start time; only the shows starting before
+    # end_time and after start_time - MAX_SHOW_DURATION can overlap.
+    index = bisect.bisect_left(owner_shows, (end_time,))
+    while index > 0 and owner_shows[index - 1][0] > start_time - MAX_SHOW_DURATION:
+        index -= 1
+        if owner_shows[index][1] > start_time:
+            return True
+    return False
+
+
+def resolve_show_references(rows):
+    # Shows may reference venues and artists by id or by natural key
+    # (venue_name, venue_city, venue_state / artist_name, ...). Each side
+    # is resolved with one query per batch.
+    venue_ids = lookup_ids(Venue, rows, 'venue')
+    artist_ids = lookup_ids(Artist, rows, 'artist')
+    resolved = []
+    for row in rows:
+        row['venue_id'] = row.get('venue_id') or venue_ids.get(reference_key(row, 'venue'))
+        row['artist_id'] = row.get('artist_id') or artist_ids.get(reference_key(row, 'artist'))
+        if row['venue_id'] and row['artist_id']:
+            row['venue_id'] = int(row['venue_id'])
+            row['artist_id'] = int(row['artist_id'])
+            resolved.append(row)
+    return resolved, len(rows) - len(resolved)
+
+
+def reference_key(row, prefix):
+    return (row.get(prefix + '_name'), row.get(prefix + '_city'), row.get(prefix + '_state'))
+
+
+def lookup_ids(model, rows, prefix):
+    keys = set(reference_key(row, prefix) for row in rows if not row.get(prefix + '_id'))
+    if not keys:
+        return {}
+    matches = db.session.query(model.id, model.name, model.city, model.state)\
+        .filter(tuple_(model.name, model.city, model.state).in_(list(keys)))
+    return dict(((match.name, match.city, match.state), match.id) for match in matches)
+
+
+def insert_genres(entity, rows):
+    names = sorted(set(name for row in rows for name in row['genres']))
+    if not names:
+        return
+    known = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(names)))
+    missing = [{'name': name} for name in names if name not in known]
+    if missing:
+        db.session.execute(Genre.__table__.insert(), missing)
+        known = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(names)))
+
+    # executemany does not return ids, so read them back by natural key.
+    owner_ids = dict(
+        (tuple(row[1:]), row[0]) for row in
+        db.session.query(entity.table.c.id, *entity.key_columns().clauses)
+        .filter(entity.key_columns().in_([entity.key(row) for row in rows]))
+    )
+    association, owner_column = entity.genres
+    links = [
+        {owner_column: owner_ids[entity.key(row)], 'genre_id': known[name]}
+        for row in rows for name in row['genres']
+    ]
+    if links:
+        db.session.execute(association.insert(), links)
+
+
+def read_rows(path):
+    # Streams dicts from .csv or .jsonl files, optionally gzip-compressed.
+    name = path[:-3] if path.endswith('.gz') else path
+    opener = gzip.open if path.endswith('.gz') else io.open
+    with opener(path, 'rt', encoding='utf-8', newline='') as source:
+        if name.endswith('.jsonl'):
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+        elif name.endswith('.csv'):
+            for row in csv.DictReader(source):
+                yield row
+        else:
+            raise click.BadParameter('Expected a .csv or .jsonl file (optionally .gz).', param_hint='PATH')
+
+
+def batches(rows, batch_size, skip):
+    batch = []
+    for index, row in enumerate(rows):
+        if index < skip:
+            continue
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def progress(totals, rows_this_run, elapsed):
+    return '%(read)d rows read, %(inserted)d inserted, %(skipped)d duplicates, %(rejected)d rejected' % totals \
+        + ' (%.0f rows/s)' % ((rows_this_run / elapsed) if elapsed else 0)
+
+
+class Checkpoint:
+    # Number of rows already committed, stored next to the input file.
+
+    def __init__(self, path):
+        self.path = path + '.checkpoint'
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path) as checkpoint:
+            return json.load(checkpoint)['rows_committed']
+
+    def save(self, rows_committed):
+        with open(self.path, 'w') as checkpoint:
+            json.dump({'rows_committed': rows_committed}, checkpoint)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,368 @@
+# ---------------------------------------------------------------------------- #
+# Background jobs.
+#
+# Work that does not have to finish before the response is sent is
+# registered as a task and enqueued by name with JSON-serializable
+# arguments:
+#
+#   @jobs.task('warm_caches', concurrency=1)
+#   def warm_caches(namespaces): ...
+#
+#   jobs.enqueue('warm_caches', ['venues'])
+#
+# JOBS_BACKEND selects where queued jobs are kept:
+#   'thread'    in memory, run by JOBS_WORKERS threads of the same process;
+#               queued jobs are lost when the process exits.
+#   'database'  in the Job table, run by the worker threads of any process
+#               (see 'flask jobs-worker'); a job whose worker died is picked
+#               up again once its lease expires.
+#   'sync'      run immediately in the caller, errors propagate.
+# Failed jobs are retried with exponential backoff up to JOBS_MAX_ATTEMPTS.
+# ---------------------------------------------------------------------------- #
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, or_
+
+from models import Job, db
+
+
+class Task:
+
+    def __init__(self, name, func, max_attempts, concurrency):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+
+
+class JobStats:
+    # Counters since the process started; queue depth comes from the backend.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = defaultdict(lambda: {
+            'completed': 0, 'failed': 0, 'retried': 0,
+            'total_wait': 0.0, 'max_wait': 0.0, 'total_run': 0.0, 'max_run': 0.0,
+        })
+
+    def record(self, task, wait, run, outcome):
+        with self.lock:
+            stats = self.tasks[task]
+            stats[outcome] += 1
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+            stats['total_run'] += run
+            stats['max_run'] = max(stats['max_run'], run)
+
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for task, stats in self.tasks.items():
+                runs = stats['completed'] + stats['failed'] + stats['retried']
+                summary[task] = {
+                    'completed': stats['completed'],
+                    'failed': stats['failed'],
+                    'retried': stats['retried'],
+                    'avg_wait_ms': round(stats['total_wait'] / runs * 1000, 3),
+                    'max_wait_ms': round(stats['max_wait'] * 1000, 3),
+                    'avg_run_ms': round(stats['total_run'] / runs * 1000, 3),
+                    'max_run_ms': round(stats['max_run'] * 1000, 3),
+                }
+            return summary
+
+
+class MemoryBackend:
+    # Jobs are dicts ordered by run_at in a heap.
+
+    def __init__(self):
+        self.heap = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def push(self, job):
+        with self.lock:
+            heapq.heappush(self.heap, (job['run_at'], next(self.sequence), job))
+
+    def claim(self, runnable):
+        # The first due job whose task is below its concurrency limit.
+        skipped = []
+        job = None
+        with self.lock:
+            while self.heap and self.heap[0][0] <= time.time():
+                entry = heapq.heappop(self.heap)
+                if runnable(entry[2]['task']):
+                    job = entry[2]
+                    break
+                skipped.append(entry)
+            for entry in skipped:
+                heapq.heappush(self.heap, entry)
+        return job
+
+    def retry(self, job, error):
+        self.push(job)
+
+    def complete(self, job):
+        pass
+
+    def fail(self, job, error):
+        pass
+
+    def next_run_in(self, poll_interval):
+        with self.lock:
+            if not self.heap:
+                return None
+            return max(self.heap[0][0] - time.time(), 0.01)
+
+    def depth(self):
+        return len(self.heap)
+
+
+class DatabaseBackend:
+    # Jobs are rows of the Job table. A claim is an UPDATE guarded by the
+    # status the row was read with, so concurrent workers (threads or
+    # processes) never run the same job; the claimed row is leased for
+    # JOBS_LEASE seconds and becomes claimable again if it is not finished
+    # by then.
+
+    def __init__(self, lease):
+        self.lease = lease
+
+    def push(self, job):
+        with db.engine.begin() as connection:
+            job['id'] = connection.execute(Job.__table__.insert().values(
+                task=job['task'],
+                arguments=json.dumps([job['args'], job['kwargs']]),
+                status='queued',
+                attempts=job['attempts'],
+                run_at=to_datetime(job['run_at']),
+                enqueued_at=to_datetime(job['enqueued_at']),
+            )).inserted_primary_key[0]
+
+    def claim(self, runnable):
+        now = time.time()
+        table = Job.__table__
+        claimable = or_(
+            and_(table.c.status == 'queued', table.c.run_at <= to_datetime(now)),
+            and_(table.c.status == 'running', table.c.locked_until < to_datetime(now)),
+        )
+        with db.engine.begin() as connection:
+            candidates = connection.execute(
+                table.select().where(claimable).order_by(table.c.run_at, table.c.id).limit(20)
+            ).fetchall()
+            for row in candidates:
+                if not runnable(row.task):
+                    continue
+                claimed = connection.execute(
+                    table.update()
+                    .where(and_(table.c.id == row.id, table.c.status == row.status, claimable))
+                    .values(status='running', locked_until=to_datetime(now + self.lease))
+                ).rowcount
+                if claimed:
+                    args, kwargs = json.loads(row.arguments)
+                    return {
+                        'id': row.id,
+                        'task': row.task,
+                        'args': args,
+                        'kwargs': kwargs,
+                        'attempts': row.attempts,
+                        'run_at': to_timestamp(row.run_at),
+                        'enqueued_at': to_timestamp(row.enqueued_at),
+                    }
+        return None
+
+    def _finish(self, job, **values):
+        with db.engine.begin() as connection:
+            connection.execute(Job.__table__.update().where(Job.__table__.c.id == job['id']).values(**values))
+
+    def retry(self, job, error):
+        self._finish(job, status='queued', attempts=job['attempts'], run_at=to_datetime(job['run_at']),
+                     locked_until=None, last_error=error)
+
+    def complete(self, job):
+        self._finish(job, status='done', locked_until=None, finished_at=to_datetime(time.time()))
+
+    def fail(self, job, error):
+        self._finish(job, status='failed', attempts=job['attempts'], locked_until=None, last_error=error,
+                     finished_at=to_datetime(time.time()))
+
+    def next_run_in(self, poll_interval):
+        # Jobs may be enqueued by other processes, so the table is polled.
+        return poll_interval
+
+    def depth(self):
+        return db.session.query(Job).filter(Job.status == 'queued').count()
+
+
+def to_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def to_timestamp(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class JobQueue:
+
+    def __init__(self, app=None):
+        self.tasks = {}
+        self.stats = JobStats()
+        self.pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.backend_name = app.config.get('JOBS_BACKEND', 'thread')
+        if self.backend_name == 'thread':
+            self.backend = MemoryBackend()
+        elif self.backend_name == 'database':
+            self.backend = DatabaseBackend(app.config.get('JOBS_LEASE', 300))
+        elif self.backend_name == 'sync':
+            self.backend = None
+        else:
+            raise ValueError('Unknown JOBS_BACKEND: %s' % self.backend_name)
+        self.workers = app.config.get('JOBS_WORKERS', 2)
+        self.max_attempts = app.config.get('JOBS_MAX_ATTEMPTS', 5)
+        self.retry_backoff = app.config.get('JOBS_RETRY_BACKOFF', 2)
+        self.retry_backoff_max = app.config.get('JOBS_RETRY_BACKOFF_MAX', 300)
+        self.poll_interval = app.config.get('JOBS_POLL_INTERVAL', 1.0)
+        self.logger = app.logger
+        if self.backend_name == 'database':
+            # Jobs left by other processes or a previous run.
+            app.before_request(self.start)
+        app.extensions['jobs'] = self
+
+    def task(self, name, max_attempts=None, concurrency=None):
+        # concurrency caps how many jobs of this task run at once in a
+        # process; None leaves it to the number of workers.
+        def register(func):
+            self.tasks[name] = Task(name, func, max_attempts, concurrency)
+            return func
+        return register
+
+    def enqueue(self, name, *args, **kwargs):
+        if name not in self.tasks:
+            raise KeyError('Unknown task: %s' % name)
+        # Arguments go through JSON in every mode, so a task that works
+        # with threads also works with the database backend.
+        args, kwargs = json.loads(json.dumps([args, kwargs]))
+        if self.backend is None:
+            return self.tasks[name].func(*args, **kwargs)
+        now = time.time()
+        job = {'task': name, 'args': args, 'kwargs': kwargs, 'attempts': 0, 'run_at': now, 'enqueued_at': now}
+        self.start()
+        self.backend.push(job)
+        with self.condition:
+            self.wakeups += 1
+            self.condition.notify()
+
+    def start(self):
+        # Workers are started lazily and again in forked children, which do
+        # not inherit the parent's threads.
+        if self.pid == os.getpid() or self.backend is None:
+            return
+        self.pid = os.getpid()
+        # The condition only wakes idle workers up; wakeups counts the
+        # notifications, so that one sent while a worker was claiming is
+        # not missed. Claims are serialized by their own lock, which also
+        # guards the running counts the concurrency limits are checked
+        # against, so that enqueue() never waits for a claim query.
+        self.condition = threading.Condition()
+        self.wakeups = 0
+        self.claiming = threading.Lock()
+        self.running = defaultdict(int)
+        for i in range(self.workers):
+            threading.Thread(target=self.work, name='jobs-worker-%d' % i, daemon=True).start()
+
+    def runnable(self, name):
+        task = self.tasks.get(name)
+        return task is not None and (task.concurrency is None or self.running[name] < task.concurrency)
+
+    def claim(self):
+        with self.claiming:
+            job = self.backend.claim(self.runnable)
+            if job is not None:
+                self.running[job['task']] += 1
+            return job
+
+    def work(self):
+        with self.app.app_context():
+            while True:
+                with self.condition:
+                    wakeups = self.wakeups
+                job = self.claim()
+                if job is None:
+                    with self.condition:
+                        if self.wakeups == wakeups:
+                            self.condition.wait(self.backend.next_run_in(self.poll_interval))
+                    continue
+                try:
+                    self.run(job)
+                finally:
+                    with self.claiming:
+                        self.running[job['task']] -= 1
+                    with self.condition:
+                        self.wakeups += 1
+                        self.condition.notify_all()
+
+    def run(self, job):
+        task = self.tasks[job['task']]
+        started_at = time.time()
+        wait = started_at - job['run_at']
+        try:
+            task.func(*job['args'], **job['kwargs'])
+        except Exception as e:
+            db.session.rollback()
+            job['attempts'] += 1
+            error = '%s: %s' % (type(e).__name__, e)
+            if job['attempts'] < (task.max_attempts or self.max_attempts):
+                delay = min(self.retry_backoff * 2 ** (job['attempts'] - 1), self.retry_backoff_max)
+                job['run_at'] = time.time() + delay * random.uniform(0.5, 1)
+                self.backend.retry(job, error)
+                outcome = 'retried'
+                self.logger.warning('Job %s failed (attempt %d), retrying: %s', task.name, job['attempts'], error)
+            else:
+                self.backend.fail(job, error)
+                outcome = 'failed'
+                self.logger.exception('Job %s failed after %d attempts', task.name, job['attempts'])
+        else:
+            self.backend.complete(job)
+            outcome = 'completed'
+        finally:
+            db.session.remove()
+        self.stats.record(task.name, wait, time.time() - started_at, outcome)
+
+    def summary(self):
+        summary = {'backend': self.backend_name, 'workers': self.workers}
+        if self.backend is not None:
+            summary['queued'] = self.backend.depth()
+            summary['running'] = sum(self.running.values()) if self.pid == os.getpid() else 0
+        summary['tasks'] = self.stats.summary()
+        return summary
+
+
+jobs = JobQueue()
+
+
+@click.command('jobs-worker')
+@with_appcontext
+def jobs_worker_command():
+    """Run the workers of the database job queue in the foreground."""
+    if jobs.backend_name != 'database':
+        raise click.ClickException('JOBS_BACKEND must be "database" to run a separate worker.')
+    jobs.start()
+    click.echo('%d workers polling the Job table every %ss.' % (jobs.workers, jobs.poll_interval))
+    while True:
+        time.sleep(3600)
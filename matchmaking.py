@@ -0,0 +1,189 @@
+# ---------------------------------------------------------------------------- #
+# Artist-venue matchmaking.
+#
+# Usage: flask refresh-matches
+#
+# Scores every artist against every venue seeking talent, and every venue
+# against every artist seeking a venue, as a weighted sum (MATCH_WEIGHTS) of
+#   genres    the cosine similarity of their genres;
+#   location  1 in the same city, 0.5 in the same state;
+#   shows     past-show co-occurrence: the degree-normalized artist ->
+#             venue -> artist -> venue paths of the past shows, i.e. how
+#             often artists who shared venues with the artist played the
+#             venue, relative to the strongest pair.
+# Each is a sparse matrix product over the whole catalog, ranked a block
+# of rows at a time. The MATCH_TOP_K best of each artist and venue replace
+# the Match table, so a recommendation is an index lookup (see
+# queries.get_venue_matches). Run it periodically, e.g. nightly from cron;
+# the new rows' updated_at changes the API ETags and cache keys of every
+# process.
+# ---------------------------------------------------------------------------- #
+import time
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+from scipy import sparse
+
+from models import Venue, Artist, Show, Match, venue_genres, artist_genres, db
+from queries import is_past
+
+# Dense score cells held in memory at once while ranking.
+BLOCK_CELLS = 4000000
+INSERT_BATCH_SIZE = 5000
+
+
+class Side:
+    # The artists or the venues, one row each in the feature matrices.
+
+    def __init__(self, rows):
+        self.ids = np.array([row.id for row in rows], dtype=np.int64)
+        self.position = dict((row_id, i) for i, row_id in enumerate(self.ids.tolist()))
+        self.seeking = np.array([bool(row.seeking) for row in rows])
+        self.areas = [area_key(row.city, row.state) for row in rows]
+
+
+def area_key(city, state):
+    city = ' '.join((city or '').casefold().split())
+    state = (state or '').strip().upper()
+    return (city, state) if city and state else None
+
+
+def incidence(pairs, shape):
+    rows, columns = zip(*pairs) if pairs else ((), ())
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def features(side, genre_links, genre_count, cities, states):
+    side.genres = normalize_rows(incidence(
+        [(side.position[owner_id], genre_id) for owner_id, genre_id in genre_links if owner_id in side.position],
+        (len(side.ids), genre_count),
+    ))
+    located = [(i, area) for i, area in enumerate(side.areas) if area is not None]
+    side.cities = incidence([(i, cities[area]) for i, area in located], (len(side.ids), len(cities)))
+    side.states = incidence([(i, states[area[1]]) for i, area in located], (len(side.ids), len(states)))
+
+
+def load_catalog():
+    artists = Side(db.session.query(
+        Artist.id, Artist.city, Artist.state, Artist.seeking_venue.label('seeking')
+    ).order_by(Artist.id).all())
+    venues = Side(db.session.query(
+        Venue.id, Venue.city, Venue.state, Venue.seeking_talent.label('seeking')
+    ).order_by(Venue.id).all())
+
+    areas = sorted(set(area for area in artists.areas + venues.areas if area is not None))
+    cities = dict((area, i) for i, area in enumerate(areas))
+    states = dict((state, i) for i, state in enumerate(sorted(set(state for city, state in areas))))
+    artist_links = db.session.query(artist_genres.c.artist_id, artist_genres.c.genre_id).all()
+    venue_links = db.session.query(venue_genres.c.venue_id, venue_genres.c.genre_id).all()
+    genre_count = max([genre_id for owner_id, genre_id in artist_links + venue_links] or [0]) + 1
+    features(artists, artist_links, genre_count, cities, states)
+    features(venues, venue_links, genre_count, cities, states)
+
+    # Artist x venue incidence of past shows, scaled by 1/sqrt(degree) on
+    # both sides so every entry of its powers stays within [0, 1].
+    played = incidence([
+        (artists.position[row.artist_id], venues.position[row.venue_id])
+        for row in db.session.query(Show.artist_id, Show.venue_id).filter(is_past()).distinct()
+        if row.artist_id in artists.position and row.venue_id in venues.position
+    ], (len(artists.ids), len(venues.ids)))
+    artist_degrees = np.asarray(played.sum(axis=1)).ravel()
+    venue_degrees = np.asarray(played.sum(axis=0)).ravel()
+    played = sparse.diags(1 / np.sqrt(np.maximum(artist_degrees, 1))) @ played \
+        @ sparse.diags(1 / np.sqrt(np.maximum(venue_degrees, 1)))
+    artists.played = played.tocsr()
+    venues.played = played.T.tocsr()
+    artists.show_scale = venues.show_scale = show_scale(artists)
+    return artists, venues
+
+
+def show_paths(side, rows):
+    return side.played[rows] @ side.played.T @ side.played
+
+
+def show_scale(artists):
+    # The path scores are far below 1 in practice; they are rescaled so the
+    # strongest pair of the catalog scores 1, like the other two.
+    block_rows = max(1, BLOCK_CELLS // max(artists.played.shape[1], 1))
+    highest = max([
+        show_paths(artists, slice(start, start + block_rows)).max()
+        for start in range(0, len(artists.ids), block_rows)
+    ] or [0])
+    return 1 / highest if highest > 0 else 1
+
+
+def rank(left, right, weights, top_k):
+    # Yields (left position, right position, rank, score, genre score,
+    # location score, show score) for the top_k candidates of every left
+    # row, among the right rows that are seeking.
+    block_rows = max(1, BLOCK_CELLS // max(len(right.ids), 1))
+    k = min(top_k, int(right.seeking.sum()))
+    if k == 0:
+        return
+    for start in range(0, len(left.ids), block_rows):
+        rows = slice(start, start + block_rows)
+        genre = (left.genres[rows] @ right.genres.T).toarray()
+        location = 0.5 * (left.cities[rows] @ right.cities.T).toarray() \
+            + 0.5 * (left.states[rows] @ right.states.T).toarray()
+        show = left.show_scale * show_paths(left, rows).toarray()
+        score = weights['genres'] * genre + weights['location'] * location + weights['shows'] * show
+        score[:, ~right.seeking] = 0
+        best = np.argpartition(-score, k - 1, axis=1)[:, :k]
+        for offset, columns in enumerate(best):
+            # Best first, ties by id.
+            columns = columns[np.lexsort((columns, -score[offset, columns]))]
+            for position, column in enumerate(columns):
+                if score[offset, column] <= 0:
+                    break
+                yield (start + offset, int(column), position + 1, score[offset, column],
+                       genre[offset, column], location[offset, column], show[offset, column])
+
+
+def refresh_matches(weights=None, top_k=None):
+    # Recomputes the Match table in the current transaction. Returns the
+    # number of rows written.
+    weights = weights or current_app.config['MATCH_WEIGHTS']
+    top_k = top_k or current_app.config['MATCH_TOP_K']
+    artists, venues = load_catalog()
+
+    matches = {}
+    for direction, left, right in (('artist_rank', artists, venues), ('venue_rank', venues, artists)):
+        for left_position, right_position, position, score, genre, location, show in rank(left, right, weights, top_k):
+            if direction == 'artist_rank':
+                artist_id, venue_id = left.ids[left_position], right.ids[right_position]
+            else:
+                artist_id, venue_id = right.ids[right_position], left.ids[left_position]
+            match = matches.setdefault((int(artist_id), int(venue_id)), {
+                'artist_id': int(artist_id), 'venue_id': int(venue_id),
+                'score': round(float(score), 6), 'genre_score': round(float(genre), 6),
+                'location_score': round(float(location), 6), 'show_score': round(float(show), 6),
+                'artist_rank': None, 'venue_rank': None,
+            })
+            match[direction] = position
+
+    db.session.execute(Match.__table__.delete())
+    rows = list(matches.values())
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(Match.__table__.insert(), rows[start:start + INSERT_BATCH_SIZE])
+    return len(rows)
+
+
+@click.command('refresh-matches')
+@with_appcontext
+def refresh_matches_command():
+    """Recompute the artist-venue recommendations."""
+    started_at = time.perf_counter()
+    count = refresh_matches()
+    db.session.commit()
+    click.echo('Stored %d matches in %.1f s.' % (count, time.perf_counter() - started_at))
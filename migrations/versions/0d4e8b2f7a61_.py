@@ -0,0 +1,38 @@
+"""Job table for the durable background job queue
+
+Revision ID: 0d4e8b2f7a61
+Revises: f1c7a9e3d6b2
+Create Date: 2026-10-18 13:05:42.671094
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d4e8b2f7a61'
+down_revision = 'f1c7a9e3d6b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('task', sa.String(length=120), nullable=False),
+    sa.Column('arguments', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('run_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('enqueued_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Job_status_run_at', 'Job', ['status', 'run_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Job_status_run_at', table_name='Job')
+    op.drop_table('Job')
@@ -0,0 +1,46 @@
+"""Venue coordinates and spatial indexes
+
+Revision ID: 3f6a1d9b7e42
+Revises: 8b1f4d6e2c95
+Create Date: 2026-10-18 16:40:12.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6a1d9b7e42'
+down_revision = '8b1f4d6e2c95'
+branch_labels = None
+depends_on = None
+
+
+# Same expression as models.VENUE_LOCATION.
+VENUE_LOCATION = 'geography(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326))'
+
+
+def postgis_available():
+    bind = op.get_bind()
+    return bind.dialect.name == 'postgresql' and bind.exec_driver_sql(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'postgis'"
+    ).first() is not None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.String(length=9), nullable=True))
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'], unique=False)
+    if postgis_available():
+        op.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+        op.execute('CREATE INDEX "ix_Venue_location" ON "Venue" USING gist ((%s))' % VENUE_LOCATION)
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS "ix_Venue_location"')
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
@@ -0,0 +1,56 @@
+"""Show end times and overlap constraints
+
+Revision ID: 5e9a2c7b4f18
+Revises: 0d4e8b2f7a61
+Create Date: 2026-10-18 13:52:17.304586
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9a2c7b4f18'
+down_revision = '0d4e8b2f7a61'
+branch_labels = None
+depends_on = None
+
+
+# Existing shows get the default length of two hours.
+DEFAULT_DURATION_MINUTES = 120
+owner_columns = ['venue_id', 'artist_id']
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(timezone=True), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('UPDATE "Show" SET end_time = start_time + interval \'%d minutes\'' % DEFAULT_DURATION_MINUTES)
+    else:
+        # Keeps the fractional seconds suffix SQLAlchemy writes, so the
+        # stored strings still compare in time order.
+        op.execute(
+            'UPDATE "Show" SET end_time = datetime(start_time, \'+%d minutes\') || substr(start_time, 20)'
+            % DEFAULT_DURATION_MINUTES
+        )
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(timezone=True), nullable=False)
+        batch_op.create_check_constraint('ck_Show_end_after_start', 'end_time > start_time')
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # Fails if existing shows already overlap; those have to be
+        # rescheduled first.
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for owner_column in owner_columns:
+            op.execute(
+                'ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_%s_overlap" '
+                'EXCLUDE USING gist (%s WITH =, tstzrange(start_time, end_time) WITH &&)' % (owner_column, owner_column)
+            )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for owner_column in reversed(owner_columns):
+            op.execute('ALTER TABLE "Show" DROP CONSTRAINT "ex_Show_%s_overlap"' % owner_column)
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_constraint('ck_Show_end_after_start', type_='check')
+        batch_op.drop_column('end_time')
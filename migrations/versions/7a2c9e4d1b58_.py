@@ -0,0 +1,104 @@
+"""Normalize venue and artist genres into association tables
+
+Revision ID: 7a2c9e4d1b58
+Revises: e4b1f2a9c7d3
+Create Date: 2026-10-18 10:03:17.228140
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a2c9e4d1b58'
+down_revision = 'e4b1f2a9c7d3'
+branch_labels = None
+depends_on = None
+
+
+genre_table = sa.table('Genre', sa.column('id', sa.Integer), sa.column('name', sa.String))
+owners = [
+    # (owner table, association table, owner column)
+    ('Venue', 'Venue_Genre', 'venue_id'),
+    ('Artist', 'Artist_Genre', 'artist_id'),
+]
+
+
+def upgrade():
+    op.create_table('Genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('Venue_Genre',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ),
+    sa.PrimaryKeyConstraint('venue_id', 'genre_id')
+    )
+    op.create_index('ix_Venue_Genre_genre_id', 'Venue_Genre', ['genre_id'], unique=False)
+    op.create_table('Artist_Genre',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+    sa.PrimaryKeyConstraint('artist_id', 'genre_id')
+    )
+    op.create_index('ix_Artist_Genre_genre_id', 'Artist_Genre', ['genre_id'], unique=False)
+
+    # Backfill the association tables from the comma-joined strings.
+    connection = op.get_bind()
+    memberships = {}
+    for owner, association, owner_column in owners:
+        owner_table = sa.table(owner, sa.column('id', sa.Integer), sa.column('genres', sa.String))
+        rows = connection.execute(sa.select([owner_table.c.id, owner_table.c.genres]))
+        memberships[owner] = [
+            (row.id, name.strip())
+            for row in rows if row.genres
+            for name in set(row.genres.split(',')) if name.strip()
+        ]
+
+    names = sorted(set(name for rows in memberships.values() for _, name in rows))
+    if names:
+        op.bulk_insert(genre_table, [{'name': name} for name in names])
+    genre_ids = dict((row.name, row.id) for row in connection.execute(sa.select([genre_table.c.name, genre_table.c.id])))
+
+    for owner, association, owner_column in owners:
+        association_table = sa.table(association, sa.column(owner_column, sa.Integer), sa.column('genre_id', sa.Integer))
+        rows = [{owner_column: owner_id, 'genre_id': genre_ids[name]} for owner_id, name in memberships[owner]]
+        if rows:
+            op.bulk_insert(association_table, rows)
+
+    op.drop_column('Venue', 'genres')
+    op.drop_column('Artist', 'genres')
+
+
+def downgrade():
+    op.add_column('Artist', sa.Column('genres', sa.VARCHAR(length=120), autoincrement=False, nullable=True))
+    op.add_column('Venue', sa.Column('genres', sa.VARCHAR(length=120), autoincrement=False, nullable=True))
+
+    # Rebuild the comma-joined strings before dropping the association tables.
+    connection = op.get_bind()
+    for owner, association, owner_column in owners:
+        owner_table = sa.table(owner, sa.column('id', sa.Integer), sa.column('genres', sa.String))
+        association_table = sa.table(association, sa.column(owner_column, sa.Integer), sa.column('genre_id', sa.Integer))
+        rows = connection.execute(
+            sa.select([association_table.c[owner_column], genre_table.c.name])
+            .select_from(association_table.join(genre_table, genre_table.c.id == association_table.c.genre_id))
+            .order_by(association_table.c[owner_column], genre_table.c.name)
+        )
+        genres = {}
+        for owner_id, name in rows:
+            genres.setdefault(owner_id, []).append(name)
+        for owner_id, names in genres.items():
+            connection.execute(
+                owner_table.update().where(owner_table.c.id == owner_id).values(genres=','.join(names))
+            )
+
+    op.drop_index('ix_Artist_Genre_genre_id', table_name='Artist_Genre')
+    op.drop_table('Artist_Genre')
+    op.drop_index('ix_Venue_Genre_genre_id', table_name='Venue_Genre')
+    op.drop_table('Venue_Genre')
+    op.drop_table('Genre')
@@ -0,0 +1,37 @@
+"""updated_at on venues, artists and shows
+
+Revision ID: 8b1f4d6e2c95
+Revises: 5e9a2c7b4f18
+Create Date: 2026-10-18 15:21:44.906317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1f4d6e2c95'
+down_revision = '5e9a2c7b4f18'
+branch_labels = None
+depends_on = None
+
+
+tables = ['Venue', 'Artist', 'Show']
+
+
+def upgrade():
+    for table in tables:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+        # Existing rows count as changed now; afterwards the application
+        # sets the column on every write.
+        op.execute('UPDATE "%s" SET updated_at = CURRENT_TIMESTAMP' % table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+        op.create_index('ix_%s_updated_at' % table, table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in reversed(tables):
+        op.drop_index('ix_%s_updated_at' % table, table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
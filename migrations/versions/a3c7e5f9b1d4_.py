@@ -0,0 +1,27 @@
+"""Geohash index usable by prefix searches under any collation
+
+Revision ID: a3c7e5f9b1d4
+Revises: d9f2b6c4a815
+Create Date: 2026-10-19 17:25:08.640213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c7e5f9b1d4'
+down_revision = 'd9f2b6c4a815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'], unique=False,
+                    postgresql_ops={'geohash': 'text_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'], unique=False)
@@ -0,0 +1,40 @@
+"""Precomputed artist-venue matches
+
+Revision ID: a7c4e2f9b136
+Revises: 3f6a1d9b7e42
+Create Date: 2026-10-18 18:05:33.142870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e2f9b136'
+down_revision = '3f6a1d9b7e42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Match',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('genre_score', sa.Float(), nullable=False),
+    sa.Column('location_score', sa.Float(), nullable=False),
+    sa.Column('show_score', sa.Float(), nullable=False),
+    sa.Column('artist_rank', sa.Integer(), nullable=True),
+    sa.Column('venue_rank', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ),
+    sa.PrimaryKeyConstraint('artist_id', 'venue_id')
+    )
+    op.create_index('ix_Match_artist_id_artist_rank', 'Match', ['artist_id', 'artist_rank'], unique=False)
+    op.create_index('ix_Match_venue_id_venue_rank', 'Match', ['venue_id', 'venue_rank'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Match_venue_id_venue_rank', table_name='Match')
+    op.drop_index('ix_Match_artist_id_artist_rank', table_name='Match')
+    op.drop_table('Match')
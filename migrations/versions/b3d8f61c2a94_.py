@@ -0,0 +1,30 @@
+"""Indexes for the show timeline, shows feed and venue area queries
+
+Revision ID: b3d8f61c2a94
+Revises: 7a2c9e4d1b58
+Create Date: 2026-10-18 11:26:54.917302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d8f61c2a94'
+down_revision = '7a2c9e4d1b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+    op.create_index('ix_Venue_city_state', 'Venue', ['city', 'state'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_city_state', table_name='Venue')
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
@@ -0,0 +1,28 @@
+"""updated_at on matches
+
+Revision ID: c5e8b3a1d7f2
+Revises: a7c4e2f9b136
+Create Date: 2026-10-19 10:12:37.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8b3a1d7f2'
+down_revision = 'a7c4e2f9b136'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Match', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+    op.execute('UPDATE "Match" SET updated_at = CURRENT_TIMESTAMP')
+    with op.batch_alter_table('Match') as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Match') as batch_op:
+        batch_op.drop_column('updated_at')
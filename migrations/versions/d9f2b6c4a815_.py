@@ -0,0 +1,43 @@
+"""Table write counters and per-owner show versions
+
+Revision ID: d9f2b6c4a815
+Revises: c5e8b3a1d7f2
+Create Date: 2026-10-19 14:02:51.337904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9f2b6c4a815'
+down_revision = 'c5e8b3a1d7f2'
+branch_labels = None
+depends_on = None
+
+
+# Same as models.VERSIONED_TABLES.
+VERSIONED_TABLES = ('Venue', 'Artist', 'Show', 'Match')
+
+
+def upgrade():
+    table_version = op.create_table('TableVersion',
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    op.bulk_insert(table_version, [{'table_name': name, 'version': 0} for name in VERSIONED_TABLES])
+    op.create_index('ix_Show_venue_id_updated_at', 'Show', ['venue_id', 'updated_at'], unique=False)
+    op.create_index('ix_Show_artist_id_updated_at', 'Show', ['artist_id', 'updated_at'], unique=False)
+    op.drop_index('ix_Show_updated_at', table_name='Show')
+    op.drop_index('ix_Venue_updated_at', table_name='Venue')
+    op.drop_index('ix_Artist_updated_at', table_name='Artist')
+
+
+def downgrade():
+    op.create_index('ix_Artist_updated_at', 'Artist', ['updated_at'], unique=False)
+    op.create_index('ix_Venue_updated_at', 'Venue', ['updated_at'], unique=False)
+    op.create_index('ix_Show_updated_at', 'Show', ['updated_at'], unique=False)
+    op.drop_index('ix_Show_artist_id_updated_at', table_name='Show')
+    op.drop_index('ix_Show_venue_id_updated_at', table_name='Show')
+    op.drop_table('TableVersion')
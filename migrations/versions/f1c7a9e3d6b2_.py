@@ -0,0 +1,57 @@
+"""Upcoming show counters on venues and artists
+
+Revision ID: f1c7a9e3d6b2
+Revises: b3d8f61c2a94
+Create Date: 2026-10-18 12:40:08.513927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c7a9e3d6b2'
+down_revision = 'b3d8f61c2a94'
+branch_labels = None
+depends_on = None
+
+
+show_table = sa.table(
+    'Show',
+    sa.column('id', sa.Integer),
+    sa.column('venue_id', sa.Integer),
+    sa.column('artist_id', sa.Integer),
+    sa.column('start_time', sa.DateTime(timezone=True)),
+)
+owners = [
+    # (owner table, show column)
+    ('Venue', 'venue_id'),
+    ('Artist', 'artist_id'),
+]
+
+
+def upgrade():
+    for owner, show_column in owners:
+        op.add_column(owner, sa.Column('upcoming_show_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(owner, sa.Column('next_show_at', sa.DateTime(timezone=True), nullable=True))
+        op.create_index('ix_%s_next_show_at' % owner, owner, ['next_show_at'], unique=False)
+
+        # Backfill; afterwards the application keeps them up to date.
+        owner_table = sa.table(
+            owner,
+            sa.column('id', sa.Integer),
+            sa.column('upcoming_show_count', sa.Integer),
+            sa.column('next_show_at', sa.DateTime(timezone=True)),
+        )
+        upcoming = [show_table.c[show_column] == owner_table.c.id, show_table.c.start_time > sa.func.now()]
+        op.execute(owner_table.update().values(
+            upcoming_show_count=sa.select([sa.func.count(show_table.c.id)]).where(sa.and_(*upcoming)).scalar_subquery(),
+            next_show_at=sa.select([sa.func.min(show_table.c.start_time)]).where(sa.and_(*upcoming)).scalar_subquery(),
+        ))
+
+
+def downgrade():
+    for owner, show_column in reversed(owners):
+        op.drop_index('ix_%s_next_show_at' % owner, table_name=owner)
+        op.drop_column(owner, 'next_show_at')
+        op.drop_column(owner, 'upcoming_show_count')
@@ -1,22 +1,134 @@
 # ---------------------------------------------------------------------------- #
 # Models.
 # ---------------------------------------------------------------------------- #
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime, timedelta, timezone
+
+import flask_sqlalchemy
+from flask import g, has_app_context
+from sqlalchemy import DDL, Table, event, inspect, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
+
+import geo
+from pooling import pool_options
+
+
+class RoutingSession(flask_sqlalchemy.SignallingSession):
+    # Runs the queries of a request on the replica bind chosen for it (see
+    # replicas.py); flushes and every request without one use the primary.
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica is not None and not self._flushing:
+            return flask_sqlalchemy.get_state(self.app).db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        options.update(pool_options(app.config, sa_url.get_backend_name()))
+        return sa_url, options
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 
 db = SQLAlchemy()
 
 
+venue_genres = db.Table(
+    'Venue_Genre',
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Index('ix_Venue_Genre_genre_id', 'genre_id'),
+)
+
+artist_genres = db.Table(
+    'Artist_Genre',
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Index('ix_Artist_Genre_genre_id', 'genre_id'),
+)
+
+
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False, unique=True)
+
+    @classmethod
+    def from_names(cls, names):
+        # Existing genres are reused, unknown names are added to the session.
+        names = sorted(set(name.strip() for name in names if name.strip()))
+        if not names:
+            return []
+        genres = {genre.name: genre for genre in cls.query.filter(cls.name.in_(names))}
+        for name in names:
+            if name not in genres:
+                genres[name] = cls(name=name)
+                db.session.add(genres[name])
+        return [genres[name] for name in names]
+
+
+# Shows are booked for [start_time, end_time). Bounding their length lets a
+# conflict check scan only the shows that start within MAX_SHOW_DURATION
+# before the new one (see queries.find_show_conflict).
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+MAX_SHOW_DURATION = timedelta(hours=24)
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def default_end_time(context):
+    start_time = context.get_current_parameters().get('start_time')
+    return start_time + DEFAULT_SHOW_DURATION if start_time is not None else None
+
+
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+        db.CheckConstraint('end_time > start_time', name='ck_Show_end_after_start'),
+        db.Index('ix_Show_venue_id_updated_at', 'venue_id', 'updated_at'),
+        db.Index('ix_Show_artist_id_updated_at', 'artist_id', 'updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime(timezone=True))
+    end_time = db.Column(db.DateTime(timezone=True), nullable=False, default=default_end_time)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
+
+
+# On Postgres overlapping shows of a venue or an artist are rejected by the
+# database itself, through GiST exclusion constraints (btree_gist provides
+# the = operator class for the id columns).
+event.listen(Show.__table__, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS btree_gist'
+).execute_if(dialect='postgresql'))
+for owner_column in ('venue_id', 'artist_id'):
+    event.listen(Show.__table__, 'after_create', DDL(
+        'ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_%s_overlap" '
+        'EXCLUDE USING gist (%s WITH =, tstzrange(start_time, end_time) WITH &&)' % (owner_column, owner_column)
+    ).execute_if(dialect='postgresql'))
 
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Venue_city_state', 'city', 'state'),
+        db.Index('ix_Venue_next_show_at', 'next_show_at'),
+        db.Index('ix_Venue_geohash', 'geohash', postgresql_ops={'geohash': 'text_pattern_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -29,22 +141,167 @@ class Venue(db.Model):
     website_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, nullable=False, default=True)
     seeking_description = db.Column(db.String(500))
-    genres = db.Column(db.String(120))
+    # Filled in by the geocoder (flask geocode); geohash is derived from
+    # them, see locate_venues.
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(geo.PRECISION))
+    # Maintained by show_counters.
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime(timezone=True))
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
+    genres = db.relationship('Genre', secondary=venue_genres, order_by='Genre.name', lazy=True)
     shows = db.relationship('Show', backref='venue', lazy=True)
 
 
+# With PostGIS, nearby venues are found through a GiST index on their
+# location as a geography (see queries.get_venues_near); the expression
+# must match VENUE_LOCATION exactly. Databases without the extension
+# available rely on ix_Venue_geohash alone.
+VENUE_LOCATION = 'geography(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326))'
+
+
+def postgis_available(ddl, target, bind, **kw):
+    return bind.dialect.name == 'postgresql' and bind.exec_driver_sql(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'postgis'"
+    ).first() is not None
+
+
+event.listen(Venue.__table__, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS postgis'
+).execute_if(callable_=postgis_available))
+event.listen(Venue.__table__, 'after_create', DDL(
+    'CREATE INDEX "ix_Venue_location" ON "Venue" USING gist ((%s))' % VENUE_LOCATION
+).execute_if(callable_=postgis_available))
+
+
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_next_show_at', 'next_show_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=artist_genres, order_by='Genre.name', lazy=True)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, nullable=False, default=True)
     seeking_description = db.Column(db.String(500))
+    # Maintained by show_counters.
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime(timezone=True))
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
     shows = db.relationship('Show', backref='artist', lazy=True)
+
+
+class Match(db.Model):
+    # Precomputed artist-venue recommendations, replaced as a whole by
+    # 'flask refresh-matches' (see matchmaking.py). A pair is stored once
+    # when it is among the top matches of the artist (artist_rank), of the
+    # venue (venue_rank) or of both.
+    __tablename__ = 'Match'
+    __table_args__ = (
+        db.Index('ix_Match_artist_id_artist_rank', 'artist_id', 'artist_rank'),
+        db.Index('ix_Match_venue_id_venue_rank', 'venue_id', 'venue_rank'),
+    )
+
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    genre_score = db.Column(db.Float, nullable=False)
+    location_score = db.Column(db.Float, nullable=False)
+    show_score = db.Column(db.Float, nullable=False)
+    artist_rank = db.Column(db.Integer)
+    venue_rank = db.Column(db.Integer)
+    # Set when the row is written by a refresh; backs the API ETags.
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow)
+
+
+class TableVersion(db.Model):
+    # Write counter of each of VERSIONED_TABLES, incremented in the
+    # transaction of every INSERT, UPDATE or DELETE on it. Pages and API
+    # responses built from a whole table take their ETag and cache keys from
+    # it (see etags.py): one primary key lookup, however large the table.
+    __tablename__ = 'TableVersion'
+
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+VERSIONED_TABLES = ('Venue', 'Artist', 'Show', 'Match')
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def add_table_versions(target, connection, **kw):
+    connection.execute(target.insert(), [{'table_name': name, 'version': 0} for name in VERSIONED_TABLES])
+
+
+@event.listens_for(Engine, 'after_execute')
+def bump_table_version(connection, clauseelement, multiparams, params, execution_options, result):
+    # Covers flushes, bulk query updates and deletes and Core statements on
+    # the models' tables alike; raw SQL text and the lightweight tables of
+    # migrations are not seen.
+    table = getattr(clauseelement, 'table', None)
+    if isinstance(clauseelement, UpdateBase) and isinstance(table, Table) and table.name in VERSIONED_TABLES:
+        connection.execute(
+            TableVersion.__table__.update()
+            .where(TableVersion.table_name == table.name)
+            .values(version=TableVersion.version + 1)
+        )
+
+
+# updated_at backs the ETags of the pages (see etags.py). Column changes,
+# including bulk updates such as the show counters, set it through onupdate;
+# this also covers rows whose only change is a relationship, e.g. a venue's
+# genres.
+@event.listens_for(RoutingSession, 'before_flush')
+def touch_modified_rows(session, flush_context, instances):
+    now = utcnow()
+    for instance in session.dirty:
+        if isinstance(instance, (Venue, Artist, Show)) and session.is_modified(instance):
+            instance.updated_at = now
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def locate_venues(session, flush_context, instances):
+    # Coordinates geocoded from a venue's city are dropped when it moves, so
+    # the next geocoder run places it again; the geohash follows them.
+    for venue in list(session.new) + list(session.dirty):
+        if not isinstance(venue, Venue):
+            continue
+        state = inspect(venue)
+        if venue not in session.new and (state.attrs.city.history.has_changes()
+                                         or state.attrs.state.history.has_changes()) \
+                and not state.attrs.latitude.history.has_changes():
+            venue.latitude = venue.longitude = None
+        if venue.latitude is None or venue.longitude is None:
+            geohash = None
+        else:
+            geohash = geo.encode(venue.latitude, venue.longitude)
+        if venue.geohash != geohash:
+            venue.geohash = geohash
+
+
+class Job(db.Model):
+    # Queued work of the 'database' jobs backend, see jobs.py.
+    __tablename__ = 'Job'
+    __table_args__ = (
+        db.Index('ix_Job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(120), nullable=False)
+    arguments = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    run_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    enqueued_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    locked_until = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
@@ -0,0 +1,96 @@
+# ---------------------------------------------------------------------------- #
+# Connection pooling.
+# ---------------------------------------------------------------------------- #
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+class PoolMetrics:
+    # Process-wide checkout statistics, used to size workers against the
+    # database's connection limit.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def stats(self, pool, capacity):
+        stats = {
+            'pool': type(pool).__name__,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'avg_wait_ms': round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else None,
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+        }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+                'capacity': capacity,
+                'saturation': pool.checkedout() / capacity if capacity else None,
+            })
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool recording how long each checkout waited for a connection,
+    # including the connect time when a new one had to be opened.
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record(time.perf_counter() - started_at, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - started_at)
+        return connection
+
+
+def pool_options(config, backend):
+    # Engine options for server databases; SQLite keeps the driver defaults.
+    if backend == 'sqlite':
+        return {}
+    if config['DB_POOL_MODE'] == 'null':
+        # One connection per checkout, for use behind PgBouncer.
+        options = {'poolclass': NullPool}
+    elif config['DB_POOL_MODE'] == 'queue':
+        options = {
+            'poolclass': InstrumentedQueuePool,
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        }
+    else:
+        raise ValueError('Unknown DB_POOL_MODE: %s' % config['DB_POOL_MODE'])
+    if backend == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % config['DB_STATEMENT_TIMEOUT_MS']}
+    return options
+
+
+def pool_capacity(config):
+    if config['DB_POOL_MODE'] == 'queue':
+        return config['DB_POOL_SIZE'] + config['DB_MAX_OVERFLOW']
+    return None
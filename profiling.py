@@ -0,0 +1,169 @@
+# ---------------------------------------------------------------------------- #
+# Query profiling.
+# ---------------------------------------------------------------------------- #
+import heapq
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+from sqlalchemy import event
+
+from models import db
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    # Statements differing only in literal values share a shape.
+    return WHITESPACE.sub(' ', LITERALS.sub('?', statement)).strip()
+
+
+class QueryProfile:
+
+    def __init__(self, top_n):
+        self.started_at = time.perf_counter()
+        self.count = 0
+        self.duration = 0.0
+        self.top_n = top_n
+        self.slowest = []
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+        entry = (duration, self.count, statement)
+        if len(self.slowest) < self.top_n:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def slowest_statements(self):
+        return [
+            {'statement': statement, 'duration_ms': round(duration * 1000, 3)}
+            for duration, _, statement in sorted(self.slowest, reverse=True)
+        ]
+
+    def repeated_shapes(self, threshold):
+        return [
+            {'statement': shape, 'count': count}
+            for shape, count in self.shapes.most_common() if count >= threshold
+        ]
+
+
+class QueryProfiler:
+    # Counts and times every statement the request issues through the
+    # models.db engine, reports them in a Server-Timing header and logs one
+    # structured line per request. Statement shapes repeated at least
+    # N_PLUS_ONE_THRESHOLD times are flagged as likely N+1 patterns.
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_query_ms = app.config.get('SLOW_QUERY_THRESHOLD_MS', 100)
+        self.n_plus_one_threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 10)
+        self.top_n = app.config.get('QUERY_PROFILE_TOP_N', 5)
+        self.logger = app.logger
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.extensions['profiler'] = self
+
+    def instrument(self, engine):
+        if not event.contains(engine, 'before_cursor_execute', self.before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def current(self):
+        return g.get('query_profile') if has_request_context() else None
+
+    def start(self):
+        # The engine is created lazily, so it is instrumented on first use.
+        self.instrument(db.get_engine())
+        g.query_profile = QueryProfile(self.top_n)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context rather than the connection, so that
+        # a statement that fails, and never reaches after_cursor_execute,
+        # leaves nothing behind.
+        if context is not None:
+            context._query_started_at = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started_at = getattr(context, '_query_started_at', None)
+        if started_at is None:
+            return
+        duration = time.perf_counter() - started_at
+        profile = self.current()
+        if profile is not None:
+            profile.record(statement, duration)
+
+    def finish(self, response):
+        profile = self.current()
+        if profile is None:
+            return response
+
+        elapsed_ms = (time.perf_counter() - profile.started_at) * 1000
+        db_ms = profile.duration * 1000
+        response.headers.add(
+            'Server-Timing',
+            'db;dur=%.3f;desc="%d queries", app;dur=%.3f' % (db_ms, profile.count, elapsed_ms)
+        )
+
+        slow_queries = [
+            entry for entry in profile.slowest_statements() if entry['duration_ms'] >= self.slow_query_ms
+        ]
+        n_plus_one = profile.repeated_shapes(self.n_plus_one_threshold)
+        self.logger.log(
+            logging.WARNING if slow_queries or n_plus_one else logging.INFO,
+            'request',
+            extra={'fields': {
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'duration_ms': round(elapsed_ms, 3),
+                'db_queries': profile.count,
+                'db_time_ms': round(db_ms, 3),
+                'slowest_queries': profile.slowest_statements(),
+                'slow_queries': slow_queries,
+                'n_plus_one': n_plus_one,
+            }}
+        )
+        return response
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'location': '%s:%d' % (record.pathname, record.lineno),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(app):
+    # One JSON object per line, written to LOG_FILE or to stderr.
+    if app.config.get('LOG_FILE'):
+        handler = logging.FileHandler(app.config['LOG_FILE'])
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter())
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(handler)
+    app.logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+
+
+profiler = QueryProfiler()
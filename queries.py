@@ -0,0 +1,379 @@
+# ---------------------------------------------------------------------------- #
+# Queries.
+# ---------------------------------------------------------------------------- #
+import base64
+from datetime import timezone
+
+import dateutil.parser
+from flask import current_app
+from sqlalchemy import and_, func, literal_column, or_, text, tuple_
+
+import geo
+from models import (Venue, Artist, Show, Genre, Match, venue_genres, artist_genres, db, MAX_SHOW_DURATION,
+                    VENUE_LOCATION)
+
+
+def _session(session):
+    # Every query helper runs on the Flask-SQLAlchemy session unless given
+    # another one, e.g. the sync facade of an AsyncSession (see asgi.py).
+    return db.session if session is None else session
+
+
+def as_utc(value):
+    # Stored naive times are UTC, the zone of the database's now(). Aware
+    # arguments are converted so they compare correctly on every backend:
+    # SQLite keeps the UTC wall time as text, Postgres a timestamptz.
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def is_upcoming():
+    return Show.start_time > func.now()
+
+
+def is_past():
+    return Show.start_time <= func.now()
+
+
+def count_upcoming_shows():
+    # COUNT(Show.id) FILTER (WHERE Show.start_time > now())
+    return func.count(Show.id).filter(is_upcoming())
+
+
+def count_past_shows():
+    return func.count(Show.id).filter(is_past())
+
+
+def get_venue_areas(genre=None, session=None):
+    # One statement for the whole area -> venues -> upcoming count tree,
+    # reading the counters kept by show_counters. Rows come back sorted by
+    # area so they can be folded in a single pass.
+    rows = _session(session).query(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        Venue.upcoming_show_count.label('num_upcoming_shows'),
+    )
+    if genre is not None:
+        rows = rows.filter(Venue.id.in_(genre_members(venue_genres.c.venue_id, genre, session)))
+    rows = rows.order_by(Venue.city, Venue.state, Venue.id)
+
+    areas = []
+    for row in rows:
+        if not areas or areas[-1]['city'] != row.city or areas[-1]['state'] != row.state:
+            areas.append({
+                'city': row.city,
+                'state': row.state,
+                'venues': []
+            })
+        areas[-1]['venues'].append({
+            'id': row.id,
+            'name': row.name,
+            'num_upcoming_shows': row.num_upcoming_shows,
+        })
+    return areas
+
+
+def get_artists(genre=None, session=None):
+    artists = _session(session).query(Artist.id, Artist.name)
+    if genre is not None:
+        artists = artists.filter(Artist.id.in_(genre_members(artist_genres.c.artist_id, genre, session)))
+    return [row._asdict() for row in artists.order_by(Artist.id)]
+
+
+def genre_members(member_column, genre, session=None):
+    # Ids of the venues or artists tagged with the genre, resolved through
+    # the unique Genre.name index and the association table's genre_id index.
+    return _session(session).query(member_column)\
+        .join(Genre, Genre.id == member_column.table.c.genre_id)\
+        .filter(Genre.name == genre)
+
+
+def get_venue_map(venue, include_shows=True, session=None):
+    venue_map = {
+        'id': venue.id,
+        'name': venue.name,
+        'genres': [genre.name for genre in venue.genres],
+        'address': venue.address,
+        'city': venue.city,
+        'state': venue.state,
+        'phone': venue.phone,
+        'website': venue.website_link,
+        'facebook_link': venue.facebook_link,
+        'seeking_talent': venue.seeking_talent,
+        'seeking_description': venue.seeking_description,
+        'image_link': venue.image_link,
+        'latitude': venue.latitude,
+        'longitude': venue.longitude,
+    }
+    if include_shows:
+        venue_map.update(get_venue_show_timeline(venue.id, current_app.config['SHOW_TIMELINE_LIMIT'], session))
+    return venue_map
+
+
+def get_artist_map(artist, include_shows=True, session=None):
+    artist_map = {
+        'id': artist.id,
+        'name': artist.name,
+        'genres': [genre.name for genre in artist.genres],
+        'city': artist.city,
+        'state': artist.state,
+        'phone': artist.phone,
+        'website': artist.website,
+        'facebook_link': artist.facebook_link,
+        'seeking_venue': artist.seeking_venue,
+        'seeking_description': artist.seeking_description,
+        'image_link': artist.image_link,
+    }
+    if include_shows:
+        artist_map.update(get_artist_show_timeline(artist.id, current_app.config['SHOW_TIMELINE_LIMIT'], session))
+    return artist_map
+
+
+def get_venue_show_timeline(venue_id, limit=None, session=None):
+    return _get_show_timeline(
+        Show.venue_id,
+        venue_id,
+        Artist,
+        Show.artist_id == Artist.id,
+        [
+            Show.artist_id,
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link'),
+            Show.start_time,
+        ],
+        limit,
+        session
+    )
+
+
+def get_artist_show_timeline(artist_id, limit=None, session=None):
+    return _get_show_timeline(
+        Show.artist_id,
+        artist_id,
+        Venue,
+        Show.venue_id == Venue.id,
+        [
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Venue.image_link.label('venue_image_link'),
+            Show.start_time,
+        ],
+        limit,
+        session
+    )
+
+
+def _get_show_timeline(owner_column, owner_id, joined_entity, join_condition, columns, limit, session):
+    # Three statements regardless of history size: both counts in one
+    # aggregate, then each partition already joined, sorted and limited.
+    counts = _session(session).query(
+        count_upcoming_shows().label('upcoming'),
+        count_past_shows().label('past'),
+    ).filter(owner_column == owner_id).one()
+
+    shows = _session(session).query(*columns)\
+        .join(joined_entity, join_condition)\
+        .filter(owner_column == owner_id)
+    upcoming_shows = shows.filter(is_upcoming())\
+        .order_by(Show.start_time.asc(), Show.id.asc())\
+        .limit(limit)
+    past_shows = shows.filter(is_past())\
+        .order_by(Show.start_time.desc(), Show.id.desc())\
+        .limit(limit)
+
+    return {
+        'past_shows': [show._asdict() for show in past_shows],
+        'past_shows_count': counts.past,
+        'upcoming_shows': [show._asdict() for show in upcoming_shows],
+        'upcoming_shows_count': counts.upcoming,
+    }
+
+
+def _show_listing(session):
+    return _session(session).query(
+        Show.id,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Show.start_time,
+        Show.end_time,
+    ).join(Venue, Show.venue_id == Venue.id)\
+        .join(Artist, Show.artist_id == Artist.id)
+
+
+def get_shows_page(cursor=None, after=None, before=None, limit=30, session=None):
+    # Keyset pagination on (start_time, id): every page is a single indexed
+    # range scan no matter how deep into the feed it is.
+    shows = _show_listing(session)
+    if after is not None:
+        shows = shows.filter(Show.start_time >= as_utc(after))
+    if before is not None:
+        shows = shows.filter(Show.start_time < as_utc(before))
+    if cursor is not None:
+        shows = shows.filter(tuple_(Show.start_time, Show.id) > tuple_(*decode_show_cursor(cursor)))
+
+    rows = shows.order_by(Show.start_time.asc(), Show.id.asc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_show_cursor(rows[-1].start_time, rows[-1].id)
+    return [row._asdict() for row in rows], next_cursor
+
+
+def get_shows_in_window(start, end, city=None, state=None, limit=100, session=None):
+    # Shows starting in [start, end), optionally only at the venues of one
+    # city, sorted and limited by the database. Without a city this is a
+    # range scan of ix_Show_start_time_id; with one, the area's venues come
+    # from ix_Venue_city_state and each is a range of ix_Show_venue_id_start_time.
+    shows = _show_listing(session)\
+        .filter(Show.start_time >= as_utc(start), Show.start_time < as_utc(end))
+    if city is not None:
+        shows = shows.filter(Venue.city == city)
+    if state is not None:
+        shows = shows.filter(Venue.state == state)
+    shows = shows.order_by(Show.start_time.asc(), Show.id.asc()).limit(limit)
+    return [row._asdict() for row in shows]
+
+
+def get_next_shows(owner_column, owner_id, limit=10, after=None, session=None):
+    # The next shows of a venue or artist (owner_column is Show.venue_id or
+    # Show.artist_id), read forward along its (owner, start_time) index from
+    # now, or from after when given.
+    shows = _show_listing(session).filter(owner_column == owner_id)
+    shows = shows.filter(is_upcoming() if after is None else Show.start_time > as_utc(after))
+    shows = shows.order_by(Show.start_time.asc(), Show.id.asc()).limit(limit)
+    return [row._asdict() for row in shows]
+
+
+def encode_show_cursor(start_time, show_id):
+    value = '%s|%d' % (start_time.isoformat(), show_id)
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_show_cursor(cursor):
+    # Raises ValueError for anything that was not produced by encode_show_cursor.
+    start_time, show_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return as_utc(dateutil.parser.isoparse(start_time)), int(show_id)
+
+
+def find_show_conflict(owner_column, owner_id, start_time, end_time, session=None):
+    # The first show of the venue or artist overlapping [start_time,
+    # end_time), or None. Overlapping shows start after
+    # start_time - MAX_SHOW_DURATION, which bounds the (owner, start_time)
+    # index range scanned no matter how long the history is.
+    return _session(session).query(Show.id, Show.start_time, Show.end_time)\
+        .filter(
+            owner_column == owner_id,
+            Show.start_time > as_utc(start_time) - MAX_SHOW_DURATION,
+            Show.start_time < as_utc(end_time),
+            Show.end_time > as_utc(start_time),
+        )\
+        .order_by(Show.start_time)\
+        .first()
+
+
+# Engine URL -> whether the database has the PostGIS location index.
+_location_index = {}
+
+
+def has_location_index(session=None):
+    connection = _session(session).connection()
+    key = str(connection.engine.url)
+    if key not in _location_index:
+        _location_index[key] = connection.dialect.name == 'postgresql' and connection.execute(text(
+            "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_Venue_location'"
+        )).first() is not None
+    return _location_index[key]
+
+
+def get_venues_near(latitude, longitude, radius_km, limit=10, session=None):
+    # The venues within radius_km of the point, nearest first. With PostGIS
+    # this is a KNN scan of the ix_Venue_location GiST index; elsewhere the
+    # geohash cells covering the circle are read as ix_Venue_geohash prefix
+    # scans and the candidates are measured here.
+    rows = _session(session).query(
+        Venue.id,
+        Venue.name,
+        Venue.address,
+        Venue.city,
+        Venue.state,
+        Venue.latitude,
+        Venue.longitude,
+        Venue.upcoming_show_count.label('num_upcoming_shows'),
+    )
+    if has_location_index(session):
+        location = literal_column(VENUE_LOCATION)
+        point = func.geography(func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326))
+        rows = rows.add_columns((func.ST_Distance(location, point) / 1000).label('distance_km'))\
+            .filter(func.ST_DWithin(location, point, radius_km * 1000))\
+            .order_by(location.op('<->')(point))\
+            .limit(limit)
+        return [row._asdict() for row in rows]
+
+    cells = geo.covering_cells(latitude, longitude, radius_km)
+    if _session(session).connection().dialect.name == 'postgresql':
+        # A range would follow the database collation, under which '~' need
+        # not sort after the geohash alphabet; LIKE uses the text_pattern_ops
+        # index whatever the collation.
+        rows = rows.filter(or_(*[Venue.geohash.startswith(cell) for cell in cells]))
+    else:
+        # SQLite compares bytes, so the range is safe there, and it only
+        # uses an index for LIKE when LIKE is made case sensitive.
+        rows = rows.filter(or_(*[and_(Venue.geohash >= cell, Venue.geohash < cell + '~') for cell in cells]))
+    venues = []
+    for row in rows:
+        venue = row._asdict()
+        venue['distance_km'] = geo.distance_km(latitude, longitude, row.latitude, row.longitude)
+        if venue['distance_km'] <= radius_km:
+            venues.append(venue)
+    venues.sort(key=lambda venue: (venue['distance_km'], venue['id']))
+    return venues[:limit]
+
+
+def get_nearest_venues(latitude, longitude, limit=10, max_radius_km=500, start_radius_km=10, session=None):
+    # The limit nearest venues within max_radius_km. The search radius grows
+    # fourfold until it holds enough venues, so dense areas only look at
+    # their own neighbourhood.
+    radius_km = min(start_radius_km, max_radius_km)
+    while True:
+        venues = get_venues_near(latitude, longitude, radius_km, limit=limit, session=session)
+        if len(venues) >= limit or radius_km >= max_radius_km:
+            return venues
+        radius_km = min(radius_km * 4, max_radius_km)
+
+
+def get_venue_matches(artist_id, limit=10, session=None):
+    # The best venues for an artist, among those still seeking talent, read
+    # from the Match rows along ix_Match_artist_id_artist_rank.
+    return _get_matches(Match.artist_id, artist_id, Match.artist_rank, Venue, Match.venue_id,
+                        Venue.seeking_talent, limit, session)
+
+
+def get_artist_matches(venue_id, limit=10, session=None):
+    return _get_matches(Match.venue_id, venue_id, Match.venue_rank, Artist, Match.artist_id,
+                        Artist.seeking_venue, limit, session)
+
+
+def _get_matches(owner_column, owner_id, rank_column, matched_entity, matched_column, seeking_column, limit, session):
+    rows = _session(session).query(
+        matched_entity.id,
+        matched_entity.name,
+        matched_entity.city,
+        matched_entity.state,
+        matched_entity.image_link,
+        Match.score,
+        Match.genre_score,
+        Match.location_score,
+        Match.show_score,
+    ).select_from(Match).join(matched_entity, matched_column == matched_entity.id)\
+        .filter(owner_column == owner_id, rank_column.isnot(None), seeking_column.is_(True))\
+        .order_by(rank_column)\
+        .limit(limit)
+    return [row._asdict() for row in rows]
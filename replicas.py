@@ -0,0 +1,127 @@
+# ---------------------------------------------------------------------------- #
+# Read replicas.
+#
+# DATABASE_REPLICA_URLS=postgresql://replica-1/fyyur,postgresql://replica-2/fyyur
+#
+# Requests to READ_ENDPOINTS run their queries on a replica; every other
+# request, and any flush, uses the primary. After a client's own write its
+# reads stay on the primary for DB_REPLICA_STICKY_SECONDS (recorded in its
+# session cookie), so it sees what it just submitted. Replicas lagging more
+# than DB_REPLICA_MAX_LAG seconds, or unreachable, are skipped until their
+# next check; with none left, reads go to the primary. So are all reads for
+# DB_REPLICA_MAX_LAG seconds after a cache invalidation.
+# ---------------------------------------------------------------------------- #
+import random
+import threading
+import time
+
+from flask import g, request, session
+from sqlalchemy import text
+
+from cache import cache
+from models import db
+from profiling import profiler
+
+READ_ENDPOINTS = {
+    'venues', 'venues_by_genre', 'search_venues', 'show_venue',
+    'artists', 'artists_by_genre', 'search_artists', 'show_artist',
+    'shows', 'export_catalog',
+    'api.list_venues', 'api.get_venue', 'api.list_artists', 'api.get_artist',
+    'api.list_shows', 'api.list_shows_in_window', 'api.list_venue_next_shows', 'api.list_artist_next_shows',
+}
+STICKY_SESSION_KEY = 'db_primary_until'
+# Seconds since the last transaction replayed, or 0 when the replica has
+# replayed everything it received (an idle primary sends nothing new).
+POSTGRES_LAG_QUERY = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class ReplicaRouter:
+
+    def __init__(self, app=None):
+        self.binds = []
+        self.lock = threading.Lock()
+        self.lags = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Each replica becomes a Flask-SQLAlchemy bind, with the same engine
+        # and pool options as the primary.
+        urls = app.config.get('DB_REPLICA_URLS') or []
+        self.binds = ['replica%d' % i for i in range(len(urls))]
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **dict(zip(self.binds, urls)))
+        self.max_lag = app.config.get('DB_REPLICA_MAX_LAG', 5)
+        self.check_interval = app.config.get('DB_REPLICA_LAG_CHECK_INTERVAL', 1.0)
+        self.sticky_seconds = app.config.get('DB_REPLICA_STICKY_SECONDS', 10)
+        self.logger = app.logger
+        app.before_request(self.route)
+        app.after_request(self.remember_write)
+        app.extensions['replicas'] = self
+
+    def route(self):
+        if not self.binds or request.endpoint not in READ_ENDPOINTS:
+            return
+        if session.get(STICKY_SESSION_KEY, 0) > time.time():
+            return
+        if time.time() - cache.invalidated_at() < self.max_lag:
+            # Pages computed now refill the cache; a replica that has not
+            # replayed the write behind the invalidation would fill it with
+            # stale data until the next one.
+            return
+        g.db_replica = self.choose()
+        if g.db_replica is not None:
+            profiler.instrument(db.get_engine(bind=g.db_replica))
+
+    def remember_write(self, response):
+        if self.binds and request.method not in ('GET', 'HEAD', 'OPTIONS') and request.endpoint not in READ_ENDPOINTS:
+            session[STICKY_SESSION_KEY] = time.time() + self.sticky_seconds
+        return response
+
+    def choose(self):
+        lags = [(bind, self.lag(bind)) for bind in self.binds]
+        healthy = [bind for bind, lag in lags if lag is not None and lag <= self.max_lag]
+        return random.choice(healthy) if healthy else None
+
+    def lag(self, bind):
+        # Seconds behind the primary, or None while unreachable. Measured at
+        # most once per check interval per process.
+        now = time.monotonic()
+        with self.lock:
+            checked_at, lag = self.lags.get(bind, (None, None))
+            if checked_at is not None and now - checked_at < self.check_interval:
+                return lag
+            # Other threads keep using the previous value meanwhile.
+            self.lags[bind] = (now, lag)
+        lag = self.measure_lag(bind)
+        with self.lock:
+            self.lags[bind] = (time.monotonic(), lag)
+        return lag
+
+    def measure_lag(self, bind):
+        engine = db.get_engine(bind=bind)
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == 'postgresql':
+                    return float(connection.execute(POSTGRES_LAG_QUERY).scalar() or 0)
+                # Other backends have no replication to measure; only check
+                # that the replica answers.
+                connection.execute(text('SELECT 1'))
+                return 0.0
+        except Exception as e:
+            self.logger.warning('replica unreachable', extra={'fields': {'bind': bind, 'error': str(e)}})
+            return None
+
+    def summary(self):
+        return {
+            'replicas': dict(
+                (bind, {'lag_seconds': self.lags.get(bind, (None, None))[1]}) for bind in self.binds
+            ),
+            'max_lag_seconds': self.max_lag,
+            'sticky_seconds': self.sticky_seconds,
+        }
+
+
+replica_router = ReplicaRouter()
@@ -0,0 +1,51 @@
+# ---------------------------------------------------------------------------- #
+# Search.
+# ---------------------------------------------------------------------------- #
+from sqlalchemy import func
+
+from models import Venue, Artist, db
+
+
+def search_venues(search_term, limit, session=None):
+    return _search(Venue, search_term, limit, db.session if session is None else session)
+
+
+def search_artists(search_term, limit, session=None):
+    return _search(Artist, search_term, limit, db.session if session is None else session)
+
+
+def _search(entity, search_term, limit, session):
+    # On Postgres the ILIKE below is served by the pg_trgm GIN index on
+    # name and results are ranked by trigram similarity. Other databases
+    # fall back to ranking by match position and name length.
+    pattern = '%' + escape_like(search_term) + '%'
+    if session.bind.dialect.name == 'postgresql':
+        ranking = [func.similarity(entity.name, search_term).desc()]
+    else:
+        ranking = [
+            func.instr(func.lower(entity.name), search_term.lower()).asc(),
+            func.length(entity.name).asc(),
+        ]
+
+    rows = session.query(
+        entity.id,
+        entity.name,
+        entity.upcoming_show_count.label('num_upcoming_shows'),
+        func.count().over().label('total'),
+    ).filter(entity.name.ilike(pattern, escape='\\'))\
+        .order_by(*ranking, entity.name, entity.id)\
+        .limit(limit)\
+        .all()
+
+    return {
+        'count': rows[0].total if rows else 0,
+        'data': [{
+            'id': row.id,
+            'name': row.name,
+            'num_upcoming_shows': row.num_upcoming_shows,
+        } for row in rows]
+    }
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
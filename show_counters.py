@@ -0,0 +1,79 @@
+# ---------------------------------------------------------------------------- #
+# Upcoming show counters.
+#
+# Venue and Artist carry upcoming_show_count and next_show_at so listings
+# and searches read them instead of counting shows. Writes that add or
+# remove shows refresh the affected rows in their own transaction; shows
+# turning into past shows are rolled over by running periodically (e.g.
+# every few minutes from cron):
+#
+#   flask roll-shows          rows whose next show has started
+#   flask roll-shows --all    every row, after loading data by other means
+#
+# Refreshed rows get a fresh updated_at (onupdate), so the pages showing
+# them are recomputed by every process (see etags.py).
+# ---------------------------------------------------------------------------- #
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+
+from models import Venue, Artist, Show, db
+from queries import is_upcoming
+
+
+def counter_values(model, show_foreign_key):
+    # Correlated subqueries, served by the (venue_id|artist_id, start_time)
+    # indexes on Show.
+    upcoming = [show_foreign_key == model.id, is_upcoming()]
+    return {
+        'upcoming_show_count': select(func.count(Show.id)).where(*upcoming).scalar_subquery(),
+        'next_show_at': select(func.min(Show.start_time)).where(*upcoming).scalar_subquery(),
+    }
+
+
+def _refresh(model, show_foreign_key, criterion):
+    db.session.execute(
+        model.__table__.update().where(criterion).values(**counter_values(model, show_foreign_key))
+    )
+
+
+def refresh_show_counters(venue_ids=(), artist_ids=()):
+    # Recomputes the counters of the given rows within the current
+    # transaction; call it before committing the shows that changed them.
+    venue_ids = sorted(set(int(venue_id) for venue_id in venue_ids))
+    artist_ids = sorted(set(int(artist_id) for artist_id in artist_ids))
+    if venue_ids:
+        _refresh(Venue, Show.venue_id, Venue.id.in_(venue_ids))
+    if artist_ids:
+        _refresh(Artist, Show.artist_id, Artist.id.in_(artist_ids))
+
+
+def rebuild_show_counters():
+    _refresh(Venue, Show.venue_id, True)
+    _refresh(Artist, Show.artist_id, True)
+
+
+def roll_over_show_counters():
+    # Only rows whose next show has started can have changed since they
+    # were last refreshed; they are found through the next_show_at indexes.
+    # Returns the ids that were refreshed.
+    venue_ids = [row.id for row in db.session.query(Venue.id).filter(Venue.next_show_at <= func.now())]
+    artist_ids = [row.id for row in db.session.query(Artist.id).filter(Artist.next_show_at <= func.now())]
+    refresh_show_counters(venue_ids, artist_ids)
+    return venue_ids, artist_ids
+
+
+@click.command('roll-shows')
+@click.option('--all', 'rebuild', is_flag=True, help='Recompute every venue and artist.')
+@with_appcontext
+def roll_shows_command(rebuild):
+    """Refresh upcoming show counters of venues and artists."""
+    if rebuild:
+        rebuild_show_counters()
+        db.session.commit()
+        click.echo('Recomputed all venues and artists.')
+        return
+
+    venue_ids, artist_ids = roll_over_show_counters()
+    db.session.commit()
+    click.echo('Refreshed %d venues and %d artists.' % (len(venue_ids), len(artist_ids)))
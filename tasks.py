@@ -0,0 +1,42 @@
+# ---------------------------------------------------------------------------- #
+# Background tasks.
+# ---------------------------------------------------------------------------- #
+from cache import cache
+from etags import page_etags
+from jobs import jobs
+from models import Venue, Artist
+from queries import get_venue_areas, get_artists, get_venue_map, get_artist_map
+
+
+def warm_namespace(namespace):
+    # Recomputes the pages a write just invalidated, under the same keys as
+    # the views in app.py, so the next visitor does not pay for them.
+    if namespace == 'venues':
+        cache.memoize('venues', 'all|' + page_etags.version('venues'), get_venue_areas)
+    elif namespace == 'artists':
+        cache.memoize('artists', 'all|' + page_etags.version('artists'), get_artists)
+    elif namespace.startswith('venue:'):
+        venue_id = int(namespace.split(':')[1])
+        venue = Venue.query.get(venue_id)
+        if venue is not None:
+            version = page_etags.version('show_venue', venue_id=venue_id)
+            cache.memoize(namespace, 'map|' + version, lambda: get_venue_map(venue))
+    elif namespace.startswith('artist:'):
+        artist_id = int(namespace.split(':')[1])
+        artist = Artist.query.get(artist_id)
+        if artist is not None:
+            version = page_etags.version('show_artist', artist_id=artist_id)
+            cache.memoize(namespace, 'map|' + version, lambda: get_artist_map(artist))
+
+
+@jobs.task('warm_caches', concurrency=1)
+def warm_caches(namespaces):
+    for namespace in namespaces:
+        warm_namespace(namespace)
+
+
+def warm_caches_later(namespaces):
+    # A 'database' job may run in any process (see jobs.py), which warms
+    # that process's cache: only worth it when every process shares it.
+    if cache.shared or jobs.backend_name != 'database':
+        jobs.enqueue('warm_caches', namespaces)
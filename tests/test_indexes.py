@@ -0,0 +1,29 @@
+# ---------------------------------------------------------------------------- #
+# The hot queries of benchmarks/explain_indexes.py are planned as index scans.
+#
+# Usage: python -m pytest tests
+# ---------------------------------------------------------------------------- #
+import pytest
+
+from app import app
+from benchmarks.explain_indexes import ARTISTS, HOT_QUERIES, SHOWS, VENUES, capture_statements, explain
+from benchmarks.seed import seed
+
+
+@pytest.fixture(scope='module', autouse=True)
+def seeded():
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    with app.app_context():
+        seed(VENUES, ARTISTS, SHOWS)
+        yield
+
+
+@pytest.mark.parametrize('run, index', [query[1:] for query in HOT_QUERIES], ids=[query[0] for query in HOT_QUERIES])
+def test_plan_uses_index(run, index):
+    if callable(index):
+        # Depends on the database's extensions.
+        index = index()
+    statements = capture_statements(run)
+    assert statements
+    for statement, parameters in statements:
+        assert index in explain(statement, parameters), statement
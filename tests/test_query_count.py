@@ -0,0 +1,19 @@
+# ---------------------------------------------------------------------------- #
+# The /venues listing makes the same number of queries whatever its size.
+#
+# Usage: python -m pytest tests
+# ---------------------------------------------------------------------------- #
+from app import app
+from benchmarks.seed import seed
+from benchmarks.venues_query_count import DEFAULT_SIZES, count_queries
+
+
+def test_venues_query_count_is_constant():
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    counts = []
+    with app.app_context():
+        client = app.test_client()
+        for size in DEFAULT_SIZES:
+            seed(venues=size, artists=10, shows=size * 2)
+            counts.append(count_queries(client, '/venues'))
+    assert len(set(counts)) == 1, counts